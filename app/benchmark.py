@@ -0,0 +1,231 @@
+import sys, os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Benchmark offline de punta a punta: corpus sintéticos de tamaño creciente, embeddings y LLM
+# locales con latencia simulada, y por etapa (parseo, split, construcción del índice, carga,
+# recuperación, cadena) el tiempo, el throughput y el pico de RSS. Un run de MLflow por tamaño.
+# El índice se construye con app.ingest.save_vectorstore (caché y planificador de embeddings,
+# manifest, pool de procesos), con los embeddings locales inyectados como backend.
+
+import random
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+
+import mlflow
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from fpdf import FPDF
+from langchain.globals import set_verbose
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from app.fakes import FakeChatModel, FakeEmbeddings, fake_answer
+from app.ingest import EMBED_BATCH_SIZE, load_documents, save_vectorstore
+from app.rag_pipeline import build_chain, get_embeddings, load_vectorstore_from_disk, make_retriever
+
+load_dotenv()
+set_verbose(False)  # rag_pipeline activa los logs de las cadenas; no medir la impresión
+
+# Configuración
+BENCH_SIZES = [int(n) for n in os.getenv("BENCH_SIZES", "20,100,500").split(",")]  # páginas por corpus
+BENCH_PAGES_PER_PDF = int(os.getenv("BENCH_PAGES_PER_PDF", 10))
+BENCH_QUERIES = int(os.getenv("BENCH_QUERIES", 20))
+BENCH_EMBED_LATENCY = float(os.getenv("BENCH_EMBED_LATENCY", 0.05))  # segundos por llamada
+BENCH_LLM_LATENCY = float(os.getenv("BENCH_LLM_LATENCY", 0.2))
+PROMPT_VERSION = os.getenv("PROMPT_VERSION", "v1_asistente_cientifico")
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 512))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 50))
+
+WORDS = (
+    "sentinel radar orbit acquisition mode product calibration antenna swath polarisation "
+    "interferometric wide extra beam stripmap wave ground range detected single look complex "
+    "mission status report anomaly downlink station ice ocean land coverage revisit satellite"
+).split()
+IDENTIFIERS = ["IW", "EW", "SM", "WV", "GRD", "SLC", "OCN", "S1A", "S1B", "S1C", "HH", "VV", "HV", "VH"]
+
+
+def write_corpus(path, n_pages, seed=0):
+    # PDFs deterministas con texto pseudoaleatorio e identificadores como los de los reportes
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    for f in range(0, n_pages, BENCH_PAGES_PER_PDF):
+        pdf = FPDF()
+        pdf.set_font("Arial", size=10)
+        for _ in range(min(BENCH_PAGES_PER_PDF, n_pages - f)):
+            pdf.add_page()
+            paragraphs = []
+            for _ in range(6):
+                words = [rng.choice(WORDS) for _ in range(60)]
+                words[rng.randrange(60)] = f"{rng.choice(IDENTIFIERS)}_{rng.randint(100, 999)}"
+                paragraphs.append(" ".join(words).capitalize() + ".")
+            pdf.multi_cell(0, 5, "\n\n".join(paragraphs))
+        pdf.output(os.path.join(path, f"report_{f // BENCH_PAGES_PER_PDF:04d}.pdf"))
+
+
+def make_queries(n, seed=1):
+    rng = random.Random(seed)
+    queries = []
+    for i in range(n):
+        if i % 4 == 0:
+            queries.append(f"{rng.choice(IDENTIFIERS)} {rng.choice(IDENTIFIERS)}")
+        else:
+            queries.append(f"What is the {rng.choice(WORDS)} {rng.choice(WORDS)} of the {rng.choice(WORDS)}?")
+    return queries
+
+
+def _rss_mb(pid="self"):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+
+def _children_rss_mb():
+    # Procesos hijos (pool de parseo de PDFs): se buscan en /proc por ppid
+    parent, total = str(os.getpid()), 0.0
+    for pid in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                ppid = f.read().rsplit(")", 1)[1].split()[1]
+        except (OSError, IndexError):
+            continue
+        if ppid == parent:
+            total += _rss_mb(pid)
+    return total
+
+
+class RssSampler:
+    # Pico de RSS propio y de los hijos durante un bloque, muestreado cada interval_s. A
+    # diferencia de ru_maxrss (máximo de toda la vida del proceso) mide solo esa etapa.
+
+    def __init__(self, interval_s=0.02):
+        self.interval_s = interval_s
+        self.start_mb = self.peak_mb = self.children_peak_mb = 0.0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        self.peak_mb = max(self.peak_mb, _rss_mb())
+        self.children_peak_mb = max(self.children_peak_mb, _children_rss_mb())
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self._sample()
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = _rss_mb()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+class Stages:
+
+    def __init__(self):
+        self.metrics = {}
+
+    def run(self, name, fn, n_items=None):
+        start = time.perf_counter()
+        with RssSampler() as rss:
+            result = fn()
+        elapsed = time.perf_counter() - start
+        self.metrics[f"{name}_s"] = elapsed
+        if n_items is not None:
+            self.metrics[f"{name}_per_s"] = n_items / elapsed if elapsed else 0.0
+        self.metrics[f"{name}_peak_rss_mb"] = rss.peak_mb
+        self.metrics[f"{name}_rss_growth_mb"] = rss.peak_mb - rss.start_mb
+        self.metrics[f"{name}_children_peak_rss_mb"] = rss.children_peak_mb
+        print(f"  {name}: {elapsed:.2f}s, pico RSS {rss.peak_mb:.0f} MB (+{rss.peak_mb - rss.start_mb:.0f} MB)")
+        return result
+
+
+def benchmark_size(n_pages, queries):
+    llm = FakeChatModel(responder=fake_answer, latency=BENCH_LLM_LATENCY)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True)
+    stages = Stages()
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path, persist_path = os.path.join(tmp, "pdfs"), os.path.join(tmp, "vectorstore")
+        write_corpus(data_path, n_pages)
+        # Camino real de construcción; caché de embeddings vacía por corpus
+        embeddings = get_embeddings(
+            cache_path=os.path.join(tmp, "embedding_cache.sqlite"),
+            max_batch_size=EMBED_BATCH_SIZE,
+            backend=FakeEmbeddings(latency=BENCH_EMBED_LATENCY),
+        )
+
+        pages = stages.run("load_documents", lambda: load_documents(data_path), n_pages)
+        chunks = stages.run("split", lambda: splitter.split_documents(pages), len(pages))
+        build = lambda: save_vectorstore(CHUNK_SIZE, CHUNK_OVERLAP, persist_path=persist_path, data_path=data_path,
+                                         embeddings=embeddings)
+        stages.run("index_build", build, len(chunks))
+        # Sin cambios en el corpus: todo se reutiliza del manifest
+        stages.run("index_rebuild", build, len(chunks))
+        vectordb = stages.run("load_index", lambda: load_vectorstore_from_disk(persist_path, embeddings=embeddings, mmap=True))
+
+        retriever = make_retriever(vectordb)
+        latencies = []
+
+        def retrieve_all():
+            for query in queries:
+                start = time.perf_counter()
+                retriever.invoke(query)
+                latencies.append(time.perf_counter() - start)
+
+        stages.run("retrieval", retrieve_all, len(queries))
+        chain = build_chain(vectordb, prompt_version=PROMPT_VERSION, llm=llm)
+        stages.run("chain", lambda: [chain.invoke({"question": q, "chat_history": []}) for q in queries], len(queries))
+
+    return {
+        **stages.metrics,
+        **{f"index_{k}": v for k, v in embeddings.stats().items()},
+        "retrieval_p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "retrieval_p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "n_chunks": len(chunks),
+        # Máximo de toda la vida del proceso (ru_maxrss, KB en Linux)
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    queries = make_queries(BENCH_QUERIES)
+    commit = git_commit()
+    mlflow.set_experiment("benchmark")
+    rows = []
+    for n_pages in BENCH_SIZES:
+        print(f"📄 Corpus sintético de {n_pages} páginas")
+        metrics = benchmark_size(n_pages, queries)
+        with mlflow.start_run(run_name=f"benchmark_{n_pages}p"):
+            mlflow.log_params({
+                "n_pages": n_pages, "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP,
+                "n_queries": len(queries), "embed_latency_s": BENCH_EMBED_LATENCY,
+                "llm_latency_s": BENCH_LLM_LATENCY, "prompt_version": PROMPT_VERSION,
+            })
+            mlflow.log_metrics(metrics)
+            mlflow.set_tag("git_commit", commit)
+        rows.append({"n_pages": n_pages, **metrics})
+
+    columns = ["n_pages", "n_chunks"] + [f"{s}_s" for s in
+               ("load_documents", "split", "index_build", "index_rebuild", "load_index", "retrieval", "chain")] + \
+              ["index_build_peak_rss_mb", "peak_rss_mb"]
+    print(pd.DataFrame(rows)[columns].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import sys, os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Benchmark de tipos de índice FAISS sobre los vectores del índice actual:
+# recall@k contra la búsqueda exacta, latencia p50/p99 por consulta, tiempo de construcción,
+# tamaño en disco y memoria de cada spec. La memoria se mide en un proceso nuevo que abre el
+# índice guardado con app.docstore.read_index, con y sin mmap, y le hace las mismas consultas:
+# crecimiento del RSS anónimo (privado del proceso) y de las páginas del archivo mapeadas
+# (caché del SO, compartidas entre procesos). Cada spec queda como un run en MLflow.
+
+import json
+import subprocess
+import tempfile
+import time
+
+import faiss
+import mlflow
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+
+from app.docstore import _write, vectors_path
+from app.ingest import build_faiss_index
+from app.rag_pipeline import VECTOR_DIR, get_embeddings, load_vectorstore_from_disk
+
+load_dotenv()
+
+# Configuración (specs separados por ";", p. ej. "Flat;IVF256,Flat|nprobe=16;HNSW32;IVF256,PQ32")
+INDEX_SPECS = os.getenv("INDEX_SPECS", "Flat;IVF256,Flat|nprobe=8;IVF256,Flat|nprobe=32;HNSW32|efSearch=64;IVF256,PQ32|nprobe=16")
+BENCH_K = int(os.getenv("BENCH_K", 4))
+BENCH_QUERIES = int(os.getenv("BENCH_QUERIES", 500))
+BENCH_PERSIST_PATH = os.getenv("BENCH_PERSIST_PATH", VECTOR_DIR)
+BENCH_FAKE_EMBEDDINGS = os.getenv("BENCH_FAKE_EMBEDDINGS", "0") == "1"
+DATASET_PATH = "tests/eval_dataset.json"
+
+
+def corpus_vectors(vectordb):
+    if isinstance(vectordb.index, faiss.IndexFlat):
+        return vectordb.index.reconstruct_n(0, vectordb.index.ntotal)
+    # Índice no plano: se vuelven a pedir los vectores (salen de la caché de embeddings)
+    ids = [doc_id for _, doc_id in sorted(vectordb.index_to_docstore_id.items())]
+    texts = [vectordb.docstore.search(doc_id).page_content for doc_id in ids]
+    return np.array(vectordb.embeddings.embed_documents(texts), dtype="float32")
+
+
+def query_vectors(embeddings, vectors, n_queries):
+    # Preguntas del dataset + vectores del corpus con ruido, hasta completar n_queries
+    with open(DATASET_PATH) as f:
+        questions = [pair["question"] for pair in json.load(f)]
+    queries = np.array([embeddings.embed_query(q) for q in questions], dtype="float32")
+    rng = np.random.default_rng(0)
+    n_extra = max(0, n_queries - len(queries))
+    sample = vectors[rng.choice(len(vectors), n_extra, replace=len(vectors) < n_extra)]
+    noise = rng.normal(scale=0.01, size=sample.shape).astype("float32")
+    return np.vstack([queries, sample + noise])[:n_queries]
+
+
+MEMORY_SCRIPT = """
+import json, sys
+import faiss  # antes de medir: read_index lo importa al primer uso
+import numpy as np
+from app.docstore import read_index
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        fields = dict(line.split(":", 1) for line in f)
+    return {k: int(fields[k].split()[0]) / 1024 for k in ("RssAnon", "RssFile")}
+
+persist_path, queries_path, k, mmap = sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4] == "1"
+queries = np.load(queries_path)
+before = rss_mb()
+index = read_index(persist_path, mmap=mmap)
+loaded = rss_mb()
+index.search(queries, k)
+searched = rss_mb()
+print(json.dumps({
+    "load_anon_mb": loaded["RssAnon"] - before["RssAnon"],
+    "anon_mb": searched["RssAnon"] - before["RssAnon"],
+    "file_mb": searched["RssFile"] - before["RssFile"],
+}))
+"""
+
+
+def index_memory(persist_path, queries, k, mmap):
+    # Crecimiento del RSS al abrir el índice y hacer las consultas, en un proceso nuevo
+    with tempfile.NamedTemporaryFile(suffix=".npy") as f:
+        np.save(f, queries)
+        f.flush()
+        root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+        result = subprocess.run(
+            [sys.executable, "-c", MEMORY_SCRIPT, persist_path, f.name, str(k), "1" if mmap else "0"],
+            cwd=root, capture_output=True, text=True, check=True,
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def index_sizes(index, queries, k):
+    # Se guarda con el formato del repo (docstore vacío: solo interesan los vectores)
+    with tempfile.TemporaryDirectory() as tmp:
+        ids = {i: str(i) for i in range(index.ntotal)}
+        _write(tmp, index, InMemoryDocstore({i: Document(page_content="") for i in ids.values()}), ids)
+        disk_bytes = os.path.getsize(vectors_path(tmp))
+        in_memory = index_memory(tmp, queries, k, mmap=False)
+        mapped = index_memory(tmp, queries, k, mmap=True)
+    return disk_bytes, in_memory, mapped
+
+
+def benchmark_spec(spec, vectors, queries, exact_ids, k):
+    start = time.perf_counter()
+    index = build_faiss_index(vectors, spec)
+    build_s = time.perf_counter() - start
+
+    latencies, found = [], []
+    for query in queries:
+        t0 = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        found.append(ids[0])
+    recall = np.mean([len(set(f) & set(e)) / k for f, e in zip(found, exact_ids)])
+    disk_bytes, in_memory, mapped = index_sizes(index, queries, k)
+    return {
+        f"recall_at_{k}": float(recall),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "build_s": build_s,
+        "disk_mb": disk_bytes / 2**20,
+        # Sin mmap (ingesta): copia privada del índice
+        "rss_anon_mb": in_memory["anon_mb"],
+        # Con mmap (consulta): memoria privada y páginas del archivo tocadas por las consultas
+        "mmap_load_anon_mb": mapped["load_anon_mb"],
+        "mmap_anon_mb": mapped["anon_mb"],
+        "mmap_file_mb": mapped["file_mb"],
+    }
+
+
+def main():
+    if BENCH_FAKE_EMBEDDINGS:
+        from app.fakes import FakeEmbeddings
+        embeddings = FakeEmbeddings()
+    else:
+        embeddings = get_embeddings()
+    vectordb = load_vectorstore_from_disk(BENCH_PERSIST_PATH, embeddings=embeddings)
+    vectors = corpus_vectors(vectordb)
+    queries = query_vectors(embeddings, vectors, BENCH_QUERIES)
+
+    # Referencia: búsqueda exacta
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, exact_ids = exact.search(queries, BENCH_K)
+
+    mlflow.set_experiment("index_benchmark")
+    rows = []
+    for spec in [s.strip() for s in INDEX_SPECS.split(";") if s.strip()]:
+        print(f"⏱️ {spec}")
+        metrics = benchmark_spec(spec, vectors, queries, exact_ids, BENCH_K)
+        with mlflow.start_run(run_name=spec):
+            mlflow.log_params({
+                "index_spec": spec, "k": BENCH_K, "n_vectors": len(vectors),
+                "n_queries": len(queries), "dim": vectors.shape[1], "vectorstore": BENCH_PERSIST_PATH,
+            })
+            mlflow.log_metrics(metrics)
+        rows.append({"index_spec": spec, **metrics})
+
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# app/context_budget.py
+# Armado del contexto entre el retriever y el prompt: une chunks contiguos de la misma página,
+# descarta casi-duplicados (Jaccard sobre shingles de palabras) y empaqueta los chunks por
+# relevancia dentro de un presupuesto de tokens. Los tokens antes/después de la última
+# consulta de cada hilo quedan en last_stats() para reportarlos en las evaluaciones.
+
+import re
+import threading
+from typing import Callable
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+_local = threading.local()
+
+
+def last_stats():
+    return dict(getattr(_local, "stats", {}))
+
+
+def _approx_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _shingles(text, n=3):
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def _text_overlap(a, b, min_len=20, max_len=400):
+    # Largo del sufijo de `a` que es prefijo de `b` (el chunk_overlap del splitter)
+    for n in range(min(len(a), len(b), max_len), min_len - 1, -1):
+        if a.endswith(b[:n]):
+            return n
+    return 0
+
+
+def _join(a, b):
+    # Une `b` a continuación de `a` si son contiguos; None si no lo son
+    start_a, start_b = a.metadata.get("start_index"), b.metadata.get("start_index")
+    if start_a is not None and start_b is not None:
+        if start_a <= start_b <= start_a + len(a.page_content):
+            return a.page_content + b.page_content[start_a + len(a.page_content) - start_b:]
+        return None
+    overlap = _text_overlap(a.page_content, b.page_content)
+    return a.page_content + b.page_content[overlap:] if overlap else None
+
+
+def merge_adjacent(docs):
+    # Chunks de la misma página que se solapan se unen en uno; el grupo conserva la posición
+    # (relevancia) de su mejor miembro
+    merged = []
+    for doc in docs:
+        page = (doc.metadata.get("source"), doc.metadata.get("page"))
+        for i, current in enumerate(merged):
+            if (current.metadata.get("source"), current.metadata.get("page")) != page:
+                continue
+            text = _join(current, doc)
+            if text is not None:
+                merged[i] = Document(page_content=text, metadata=current.metadata)
+                break
+            text = _join(doc, current)
+            if text is not None:
+                merged[i] = Document(page_content=text, metadata=doc.metadata)
+                break
+        else:
+            merged.append(doc)
+    return merged
+
+
+def drop_near_duplicates(docs, threshold=0.8):
+    kept, kept_shingles = [], []
+    for doc in docs:
+        shingles = _shingles(doc.page_content)
+        if all(_jaccard(shingles, other) < threshold for other in kept_shingles):
+            kept.append(doc)
+            kept_shingles.append(shingles)
+    return kept
+
+
+def pack(docs, max_tokens, count_tokens=_approx_tokens):
+    # Por orden de relevancia, los chunks que entran en el presupuesto (el primero siempre)
+    packed, used = [], 0
+    for doc in docs:
+        tokens = count_tokens(doc.page_content)
+        if packed and used + tokens > max_tokens:
+            continue
+        packed.append(doc)
+        used += tokens
+    return packed
+
+
+def assemble_context(docs, max_tokens, dedup_threshold=0.8, count_tokens=_approx_tokens):
+    assembled = pack(drop_near_duplicates(merge_adjacent(docs), dedup_threshold), max_tokens, count_tokens)
+    stats = {
+        "context_chunks_before": len(docs),
+        "context_chunks_after": len(assembled),
+        "context_tokens_before": sum(count_tokens(d.page_content) for d in docs),
+        "context_tokens_after": sum(count_tokens(d.page_content) for d in assembled),
+    }
+    return assembled, stats
+
+
+class BudgetedRetriever(BaseRetriever):
+    base: BaseRetriever
+    max_tokens: int = 1500
+    dedup_threshold: float = 0.8
+    count_tokens: Callable[[str], int] = _approx_tokens
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        docs = self.base.invoke(query, config={"callbacks": run_manager.get_child() if run_manager else None})
+        assembled, stats = assemble_context(docs, self.max_tokens, self.dedup_threshold, self.count_tokens)
+        _local.stats = stats
+        return assembled
+
+    def retrieve_batch(self, queries):
+        return [
+            assemble_context(docs, self.max_tokens, self.dedup_threshold, self.count_tokens)[0]
+            for docs in self.base.retrieve_batch(queries)
+        ]
@@ -1,53 +1,48 @@
 # app/dashboard.py
-import mlflow
+import sys, os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
 import pandas as pd
 import streamlit as st
+from app.results_store import sync, load_results, list_experiments, metric_column
 
 st.set_page_config(page_title="📊 Dashboard General de Evaluación", layout="wide")
 st.title("📈 Evaluación Completa del Chatbot por Pregunta")
 
+@st.cache_data(ttl=10, show_spinner=False)
+def cargar_resultados():
+    # Snapshot local de los runs "eval_*": solo se sincronizan los runs nuevos
+    sync()
+    return load_results()
+
 # ✅ Buscar todos los experimentos que comienzan con "eval_"
-client = mlflow.tracking.MlflowClient()
-experiments = [exp for exp in client.search_experiments() if exp.name.startswith("eval_")]
+resultados = cargar_resultados()
+exp_names = list_experiments()
 
-if not experiments:
+if not exp_names:
     st.warning("No se encontraron experimentos de evaluación.")
     st.stop()
 
 # Mostrar opciones
-exp_names = [exp.name for exp in experiments]
 selected_exp_name = st.selectbox("Selecciona un experimento para visualizar:", exp_names)
 
-experiment = client.get_experiment_by_name(selected_exp_name)
-print("--- Experiment ID seleccionado: ---")
-print(experiment.experiment_id)
-runs = client.search_runs(experiment_ids=[experiment.experiment_id], order_by=["start_time DESC"])
+runs = resultados[resultados["experiment"] == selected_exp_name]
 print("--- Número de runs encontrados: ---")
 print(len(runs))
 
 # Convertir runs a DataFrame
-data = []
-for run in runs:
-    print("--- Procesando un run ---")
-    params = run.data.params
-    metrics = run.data.metrics
-    row_data = {
-        "pregunta": params.get("question"),
-        "prompt_version": params.get("prompt_version"),
-        "chunk_size": int(params.get("chunk_size", 0)),
-        "chunk_overlap": int(params.get("chunk_overlap", 0)),
-        "lc_is_correct": metrics.get("lc_is_correct", 0),
-        "Coherence": metrics.get("coherence_score", 0),
-        "Correctness": metrics.get("correctness_score", 0),
-        "Harmfulness": metrics.get("harmfulness_score", 0),
-        "Relevance": metrics.get("relevance_score", 0),
-        "Toxicity": metrics.get("toxicity_score", 0)
-    }
-    data.append(row_data)
-    print("--- Datos de una fila ---")
-    print(row_data)
-
-df = pd.DataFrame(data)
+df = pd.DataFrame({
+    "pregunta": runs["question"],
+    "prompt_version": runs["prompt_version"],
+    "chunk_size": runs["chunk_size"],
+    "chunk_overlap": runs["chunk_overlap"],
+    "lc_is_correct": metric_column(runs, "lc_is_correct"),
+    "Coherence": metric_column(runs, "coherence_score"),
+    "Correctness": metric_column(runs, "correctness_score"),
+    "Harmfulness": metric_column(runs, "harmfulness_score"),
+    "Relevance": metric_column(runs, "relevance_score"),
+    "Toxicity": metric_column(runs, "toxicity_score")
+}).reset_index(drop=True)
 print("--- DataFrame Completo ---")
 print(df)
 
@@ -0,0 +1,290 @@
+# app/docstore.py
+# Formato en disco del vectorstore sin pickle. Cada construcción es una generación con sus
+# propios archivos, y format.json (reemplazado de forma atómica, al final) apunta a ella:
+#   vectors.<gen>.npy      índices planos (Flat): vectores float32 (n, d), np.load(mmap_mode="r")
+#   index.<gen>.faiss      otros tipos de índice (faiss.write_index); IVF se carga con IO_FLAG_MMAP
+#   docstore.<gen>.sqlite  tabla docs(pos, id, text, metadata): posición en el índice -> chunk
+#   format.json            {"format": "faiss-sqlite", "version": 3, "generation": ..., "files": ...}
+# Un lector abre los archivos que nombra un mismo format.json, así vectores y docstore siempre
+# son de la misma generación aunque se reconstruya el índice mientras tanto; la conexión a
+# SQLite se abre al cargar y se comparte entre hilos, sin volver a abrir el archivo por ruta.
+# Se conserva la generación anterior (la que pueden estar abriendo otros procesos) y se borran
+# las demás. La versión 2 usaba nombres fijos (vectors.npy, index.faiss, docstore.sqlite).
+# faiss 1.7.4 ignora IO_FLAG_MMAP para IndexFlat (copia todos los vectores a memoria), por eso
+# los índices planos se guardan como .npy y se buscan con MemmapFlatIndex. Al cargar solo se
+# abren los archivos; cada chunk se lee por id cuando la búsqueda lo devuelve, así la carga no
+# crece con el corpus y varios procesos comparten las páginas de los vectores en la caché del SO.
+# Los índices anteriores (index.pkl con pickle) solo se leen con ALLOW_PICKLE_INDEX=1;
+# convert_legacy los migra.
+
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from collections.abc import Mapping
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+FORMAT_FILE = "format.json"
+DOCSTORE_FILE = "docstore.sqlite"
+INDEX_FILE = "index.faiss"
+VECTORS_FILE = "vectors.npy"
+LEGACY_FILE = "index.pkl"
+FORMAT_NAME = "faiss-sqlite"
+FORMAT_VERSION = 3  # 1: vectores siempre en index.faiss; 2: nombres de archivo fijos
+SEARCH_BLOCK_ROWS = int(os.getenv("SEARCH_BLOCK_ROWS", 16384))
+
+
+def read_format(persist_path):
+    # None si el índice es del formato anterior (pickle)
+    path = os.path.join(persist_path, FORMAT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        fmt = json.load(f)
+    if fmt.get("format") != FORMAT_NAME or fmt.get("version", 0) > FORMAT_VERSION:
+        raise ValueError(f"Formato de índice no soportado en {persist_path}: {fmt}")
+    return fmt
+
+
+def data_files(persist_path, fmt=None):
+    # {"vectors": ruta, "docstore": ruta} de la generación a la que apunta format.json
+    fmt = read_format(persist_path) if fmt is None else fmt
+    files = (fmt or {}).get("files")
+    if not files:
+        # Versión 2 y formato anterior: nombres fijos
+        vectors = VECTORS_FILE if (fmt or {}).get("index") == "npy" else INDEX_FILE
+        files = {"vectors": vectors, "docstore": DOCSTORE_FILE}
+    return {kind: os.path.join(persist_path, name) for kind, name in files.items()}
+
+
+def vectors_path(persist_path):
+    # Archivo con los vectores del índice (.npy o .faiss), None si no hay índice
+    path = data_files(persist_path)["vectors"]
+    return path if os.path.exists(path) else None
+
+
+class MemmapFlatIndex:
+    # Búsqueda exacta (como faiss.IndexFlatL2/IndexFlatIP) sobre un .npy abierto con mmap:
+    # solo lectura, por bloques de SEARCH_BLOCK_ROWS filas para no materializar la matriz
+
+    is_trained = True
+
+    def __init__(self, vectors, metric_type):
+        self.vectors = vectors
+        self.metric_type = metric_type
+        self.ntotal, self.d = vectors.shape
+        self._norms = None  # ||v||² por fila (4 bytes por vector), se calcula en la primera búsqueda L2
+
+    def search(self, x, k):
+        import faiss
+
+        x = np.ascontiguousarray(x, dtype="float32")
+        inner = self.metric_type == faiss.METRIC_INNER_PRODUCT
+        best_d = np.full((len(x), k), -np.inf if inner else np.inf, dtype="float32")
+        best_i = np.full((len(x), k), -1, dtype="int64")
+        x_norms = (x * x).sum(axis=1, keepdims=True)
+        if not inner and self._norms is None:
+            norms = np.zeros(self.ntotal, dtype="float32")
+            for start in range(0, self.ntotal, SEARCH_BLOCK_ROWS):
+                block = self.vectors[start:start + SEARCH_BLOCK_ROWS]
+                norms[start:start + len(block)] = np.einsum("ij,ij->i", block, block)
+            self._norms = norms
+        for start in range(0, self.ntotal, SEARCH_BLOCK_ROWS):
+            block = self.vectors[start:start + SEARCH_BLOCK_ROWS]
+            scores = x @ block.T
+            if not inner:
+                scores = x_norms - 2 * scores + self._norms[None, start:start + len(block)]
+            ids = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+            all_d = np.hstack([best_d, scores.astype("float32")])
+            all_i = np.hstack([best_i, ids])
+            # Los k mejores entre los anteriores y el bloque, ordenados
+            key = -all_d if inner else all_d
+            order = np.argpartition(key, k - 1, axis=1)[:, :k]
+            order = np.take_along_axis(order, np.argsort(np.take_along_axis(key, order, axis=1), axis=1, kind="stable"), axis=1)
+            best_d = np.take_along_axis(all_d, order, axis=1)
+            best_i = np.take_along_axis(all_i, order, axis=1)
+        best_i[~np.isfinite(best_d)] = -1
+        return best_d, best_i
+
+    def reconstruct(self, i):
+        return np.array(self.vectors[int(i)])
+
+    def reconstruct_n(self, start, n):
+        return np.array(self.vectors[start:start + n])
+
+
+def read_index(persist_path, mmap=False, fmt=None):
+    # mmap=True (consulta): vectores planos con np.load(mmap_mode="r") y el resto de los tipos
+    # con IO_FLAG_MMAP. Sin mmap, índice faiss en memoria (modificable, para la ingesta).
+    import faiss
+
+    fmt = (read_format(persist_path) if fmt is None else fmt) or {}
+    path = data_files(persist_path, fmt)["vectors"]
+    if fmt.get("index") == "npy":
+        vectors = np.load(path, mmap_mode="r" if mmap else None)
+        metric = faiss.METRIC_INNER_PRODUCT if fmt.get("metric") == "ip" else faiss.METRIC_L2
+        if mmap:
+            return MemmapFlatIndex(vectors, metric)
+        index = faiss.IndexFlatIP(vectors.shape[1]) if metric == faiss.METRIC_INNER_PRODUCT else faiss.IndexFlatL2(vectors.shape[1])
+        index.add(np.ascontiguousarray(vectors, dtype="float32"))
+        return index
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+    return faiss.read_index(path, flags)
+
+
+class _Connection:
+    # Conexión de solo lectura abierta al cargar y compartida entre hilos: queda atada al archivo
+    # de esa generación aunque format.json pase a otra. Tras un fork se reabre la misma ruta
+    # (las conexiones no sobreviven a fork); los archivos de la generación anterior se conservan.
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        uri = f"file:{os.path.abspath(self.path)}?mode=ro"
+        self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._pid = os.getpid()
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            return self._conn.execute(sql, params).fetchall()
+
+
+class SQLiteDocstore(Docstore):
+    # Docstore de solo lectura: search(id) lee un chunk de docstore.sqlite
+
+    def __init__(self, path):
+        self.connection = _Connection(path)
+
+    def search(self, search):
+        rows = self.connection.execute("SELECT text, metadata FROM docs WHERE id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=rows[0][0], metadata=json.loads(rows[0][1]))
+
+
+class SQLiteIdMap(Mapping):
+    # index_to_docstore_id de FAISS (posición -> id) leído de la misma base
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._len = None
+
+    def __getitem__(self, pos):
+        rows = self.connection.execute("SELECT id FROM docs WHERE pos = ?", (int(pos),))
+        if not rows:
+            raise KeyError(pos)
+        return rows[0][0]
+
+    def __len__(self):
+        if self._len is None:
+            self._len = self.connection.execute("SELECT COUNT(*) FROM docs")[0][0]
+        return self._len
+
+    def __iter__(self):
+        return (pos for (pos,) in self.connection.execute("SELECT pos FROM docs ORDER BY pos"))
+
+    def items(self):
+        return self.connection.execute("SELECT pos, id FROM docs ORDER BY pos")
+
+    def values(self):
+        return [doc_id for _, doc_id in self.items()]
+
+
+def open_docstore(persist_path, fmt=None):
+    # (docstore, index_to_docstore_id) perezosos sobre el docstore.sqlite de la generación
+    docstore = SQLiteDocstore(data_files(persist_path, fmt)["docstore"])
+    return docstore, SQLiteIdMap(docstore.connection)
+
+
+def load_docstore(persist_path, fmt=None):
+    # (docstore, index_to_docstore_id) en memoria, para modificar el índice (ingesta)
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+
+    conn = sqlite3.connect(data_files(persist_path, fmt)["docstore"])
+    try:
+        rows = conn.execute("SELECT pos, id, text, metadata FROM docs ORDER BY pos").fetchall()
+    finally:
+        conn.close()
+    docs = {doc_id: Document(id=doc_id, page_content=text, metadata=json.loads(metadata))
+            for _, doc_id, text, metadata in rows}
+    return InMemoryDocstore(docs), {pos: doc_id for pos, doc_id, _, _ in rows}
+
+
+def save_local(vectordb, persist_path):
+    # Reemplaza al FAISS.save_local de langchain
+    _write(persist_path, vectordb.index, vectordb.docstore, vectordb.index_to_docstore_id)
+
+
+def _write(persist_path, index, docstore, index_to_docstore_id):
+    # Archivos de una generación nueva (cada uno en .tmp y renombrado) y format.json al final,
+    # también en .tmp + os.replace: hasta ese momento los lectores siguen en la anterior
+    import faiss
+
+    os.makedirs(persist_path, exist_ok=True)
+    previous = read_format(persist_path)
+    generation = uuid.uuid4().hex[:12]
+    fmt = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "generation": generation}
+    if isinstance(index, (faiss.IndexFlat, MemmapFlatIndex)):
+        fmt.update({"index": "npy", "metric": "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"})
+        vectors_file = f"vectors.{generation}.npy"
+    else:
+        fmt["index"] = "faiss"
+        vectors_file = f"index.{generation}.faiss"
+    fmt["files"] = {"vectors": vectors_file, "docstore": f"docstore.{generation}.sqlite"}
+    paths = data_files(persist_path, fmt)
+
+    conn = sqlite3.connect(paths["docstore"] + ".tmp")
+    try:
+        conn.execute("CREATE TABLE docs (pos INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, text TEXT NOT NULL, metadata TEXT NOT NULL)")
+        rows = []
+        for pos, doc_id in sorted(index_to_docstore_id.items()):
+            doc = docstore.search(doc_id)
+            rows.append((pos, doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False, default=str)))
+        conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+    if fmt["index"] == "npy":
+        with open(paths["vectors"] + ".tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(index.reconstruct_n(0, index.ntotal), dtype="float32"))
+    else:
+        faiss.write_index(index, paths["vectors"] + ".tmp")
+    for path in paths.values():
+        os.replace(path + ".tmp", path)
+
+    format_path = os.path.join(persist_path, FORMAT_FILE)
+    with open(format_path + ".tmp", "w") as f:
+        json.dump(fmt, f)
+    os.replace(format_path + ".tmp", format_path)
+
+    # Se conservan la generación nueva y la anterior; se borran las demás y el index.pkl
+    keep = set(paths.values()) | (set(data_files(persist_path, previous).values()) if previous else set())
+    for name in os.listdir(persist_path):
+        path = os.path.join(persist_path, name)
+        stale = name == LEGACY_FILE or (
+            name.startswith(("vectors.", "index.", "docstore."))
+            and name.endswith((".npy", ".faiss", ".sqlite", ".tmp"))
+        )
+        if stale and path not in keep:
+            os.remove(path)
+
+
+def convert_legacy(persist_path):
+    # Migra un índice guardado con pickle (index.pkl) al formato actual, sin volver a embeber.
+    # Usa pickle: solo para índices propios.
+    import pickle
+    import faiss
+
+    with open(os.path.join(persist_path, LEGACY_FILE), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    index = faiss.read_index(os.path.join(persist_path, INDEX_FILE))
+    _write(persist_path, index, docstore, index_to_docstore_id)
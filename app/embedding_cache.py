@@ -0,0 +1,131 @@
+# app/embedding_cache.py
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+
+def text_key(model, text):
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+# Caché en disco (SQLite) delante de cualquier backend de embeddings.
+# Las entradas se indexan por (modelo, hash del texto) y se guardan como float32;
+# al superar `max_entries` se eliminan las menos usadas recientemente (LRU).
+class CachedEmbeddings(Embeddings):
+
+    def __init__(self, underlying, cache_path, model=None, max_entries=200_000):
+        self.underlying = underlying
+        self.model = model or getattr(underlying, "model", type(underlying).__name__)
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Si el backend admite checkpoints (ScheduledEmbeddings), cada lote terminado se
+        # guarda en la caché en cuanto llega, y una construcción interrumpida se reanuda
+        self._checkpointed = hasattr(underlying, "checkpoint")
+        if self._checkpointed:
+            underlying.checkpoint = self.store
+
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT, vector BLOB, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    def _lookup(self, keys):
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+        return found
+
+    def store(self, texts, vectors):
+        now = time.time()
+        rows = [
+            (text_key(self.model, text), self.model, array("f", vector).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+
+    def embed_documents(self, texts):
+        keys = [text_key(self.model, text) for text in texts]
+        found = self._lookup(list(set(keys)))
+
+        # Solo se envían al backend los textos únicos que no están en caché
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in found))
+        n_missing = sum(1 for key in keys if key not in found)
+        with self._lock:  # el planificador llama desde varios hilos
+            self.hits += len(texts) - n_missing
+            self.misses += n_missing
+        if missing:
+            vectors = self.underlying.embed_documents(missing)
+            if not self._checkpointed:
+                self.store(missing, vectors)
+            for text, vector in zip(missing, vectors):
+                found[text_key(self.model, text)] = array("f", vector).tolist()
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        key = text_key(self.model, text)
+        found = self._lookup([key])
+        with self._lock:
+            if key in found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if key in found:
+            return found[key]
+        vector = self.underlying.embed_query(text)
+        self.store([text], [vector])
+        return array("f", vector).tolist()
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "embedding_cache_hits": hits,
+            "embedding_cache_misses": misses,
+            "embedding_cache_hit_rate": hits / total if total else 0.0,
+            **(self.underlying.stats() if hasattr(self.underlying, "stats") else {}),
+        }
@@ -0,0 +1,114 @@
+# app/embedding_scheduler.py
+# Planificador de embeddings para construir índices: agrupa textos en lotes con presupuesto de
+# tokens, los envía con concurrencia acotada respetando límites de requests/tokens por minuto,
+# reintenta ante rate limits y notifica cada lote terminado (checkpoint) para poder reanudar.
+
+import threading
+import time
+from collections import deque
+
+from langchain_core.embeddings import Embeddings
+
+from app.eval_engine import call_with_retries, run_concurrent
+
+
+def _approx_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class RateLimiter:
+    # Ventana deslizante de 60 s para requests por minuto (rpm) y tokens por minuto (tpm);
+    # 0 (o negativo) desactiva el límite correspondiente, como session_rpm en RequestCoordinator
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm if rpm > 0 else None
+        self.tpm = tpm if tpm > 0 else None
+        self._events = deque()  # (timestamp, tokens)
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        if self.rpm is None and self.tpm is None:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._events and now - self._events[0][0] >= 60:
+                    self._tokens -= self._events.popleft()[1]
+                fits_requests = self.rpm is None or len(self._events) < self.rpm
+                fits_tokens = self.tpm is None or self._tokens + tokens <= self.tpm or not self._events
+                if fits_requests and fits_tokens:
+                    self._events.append((now, tokens))
+                    self._tokens += tokens
+                    return
+                wait = 60 - (now - self._events[0][0])
+            time.sleep(min(max(wait, 0.01), 1.0))
+
+
+class ScheduledEmbeddings(Embeddings):
+
+    def __init__(self, underlying, max_batch_tokens=100_000, max_batch_size=1000, max_concurrency=4,
+                 rpm=3000, tpm=1_000_000, count_tokens=_approx_tokens, checkpoint=None):
+        self.underlying = underlying
+        self.model = getattr(underlying, "model", type(underlying).__name__)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.count_tokens = count_tokens
+        # checkpoint(texts, vectors) se llama al terminar cada lote (p. ej. CachedEmbeddings.store)
+        self.checkpoint = checkpoint
+        self.limiter = RateLimiter(rpm, tpm)
+        self.n_texts = 0
+        self.n_tokens = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _batches(self, texts):
+        batches, current, current_tokens = [], [], 0
+        for i, text in enumerate(texts):
+            tokens = self.count_tokens(text)
+            if current and (current_tokens + tokens > self.max_batch_tokens or len(current) >= self.max_batch_size):
+                batches.append((current, current_tokens))
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append((current, current_tokens))
+        return batches
+
+    def _run_batch(self, texts, batch):
+        indices, tokens = batch
+        batch_texts = [texts[i] for i in indices]
+        self.limiter.acquire(tokens)
+        vectors = call_with_retries(self.underlying.embed_documents, batch_texts)
+        if self.checkpoint is not None:
+            self.checkpoint(batch_texts, vectors)
+        with self._lock:
+            self.n_texts += len(batch_texts)
+            self.n_tokens += tokens
+        return vectors
+
+    def embed_documents(self, texts):
+        start = time.perf_counter()
+        batches = self._batches(texts)
+        results = run_concurrent(lambda batch: self._run_batch(texts, batch), batches, self.max_concurrency)
+        vectors = [None] * len(texts)
+        for (indices, _), batch_vectors in zip(batches, results):
+            for i, vector in zip(indices, batch_vectors):
+                vectors[i] = vector
+        with self._lock:
+            self.seconds += time.perf_counter() - start
+        return vectors
+
+    def embed_query(self, text):
+        self.limiter.acquire(self.count_tokens(text))
+        return call_with_retries(self.underlying.embed_query, text)
+
+    def stats(self):
+        return {
+            "embed_texts": self.n_texts,
+            "embed_tokens": self.n_tokens,
+            "embed_seconds": self.seconds,
+            "embed_chunks_per_s": self.n_texts / self.seconds if self.seconds else 0.0,
+            "embed_tokens_per_s": self.n_tokens / self.seconds if self.seconds else 0.0,
+        }
@@ -0,0 +1,34 @@
+# app/eval_engine.py
+
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def is_rate_limit_error(exc):
+    # openai.RateLimitError y cualquier error HTTP 429, sin importar el SDK concreto
+    if getattr(exc, "status_code", None) == 429:
+        return True
+    return "RateLimit" in type(exc).__name__ or "rate limit" in str(exc).lower()
+
+
+def call_with_retries(fn, *args, retries=5, base_delay=1.0, max_delay=30.0, **kwargs):
+    # Reintentos con backoff exponencial + jitter solo para errores de rate limit
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries or not is_rate_limit_error(e):
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt) * (0.5 + random.random() / 2)
+            print(f"⏳ Rate limit, reintento {attempt + 1}/{retries} en {delay:.1f}s")
+            time.sleep(delay)
+
+
+def run_concurrent(fn, items, max_workers=4):
+    # Ejecuta fn sobre items con concurrencia acotada; el resultado respeta el orden de entrada
+    items = list(items)
+    if max_workers <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fn, items))
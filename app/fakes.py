@@ -0,0 +1,109 @@
+# app/fakes.py
+# Modelos locales deterministas para ejecutar evaluaciones y benchmarks sin OpenAI.
+
+import hashlib
+import json
+import math
+import re
+import time
+from typing import Callable
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+def count_tokens(text):
+    # Aproximación barata (~4 caracteres por token)
+    return max(1, len(text) // 4)
+
+
+def fake_answer(prompt):
+    return "Sentinel-1 is a C-band SAR mission of the Copernicus programme."
+
+
+def fake_qa_grade(prompt):
+    return "GRADE: CORRECT"
+
+
+def fake_score_grade(prompt):
+    return "The answer is acceptable. Rating: [[8]]"
+
+
+def fake_batched_grade(prompt):
+    # Responde al formato JSON de app/grader.py para todas las respuestas del prompt
+    ids = [int(i) for i in re.findall(r"^\[id=(\d+)\]", prompt, re.MULTILINE)]
+    keys = re.search(r"^Criteria keys: (.*)$", prompt, re.MULTILINE).group(1).split(", ")
+    return json.dumps({"results": [{"id": i, **{key: 8 for key in keys}} for i in ids]})
+
+
+class FakeChatModel(BaseChatModel):
+    responder: Callable[[str], str] = fake_answer
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = "\n".join(str(m.content) for m in messages)
+        time.sleep(self.latency)
+        text = self.responder(prompt)
+        usage = {
+            "prompt_tokens": count_tokens(prompt),
+            "completion_tokens": count_tokens(text),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        message = AIMessage(
+            content=text,
+            usage_metadata={
+                "input_tokens": usage["prompt_tokens"],
+                "output_tokens": usage["completion_tokens"],
+                "total_tokens": usage["total_tokens"],
+            },
+        )
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={"token_usage": usage, "model_name": "fake-chat"},
+        )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        # La latencia se reparte: la mitad antes del primer token y el resto entre tokens
+        prompt = "\n".join(str(m.content) for m in messages)
+        words = re.findall(r"\S+\s*", self.responder(prompt)) or [""]
+        time.sleep(self.latency / 2)
+        for word in words:
+            time.sleep(self.latency / 2 / len(words))
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word))
+            if run_manager:
+                run_manager.on_llm_new_token(word, chunk=chunk)
+            yield chunk
+
+
+class FakeEmbeddings(Embeddings):
+    # Vectores pseudo-aleatorios derivados del hash del texto (mismo texto => mismo vector)
+
+    def __init__(self, size=1536, latency=0.0, model=None):
+        self.size = size
+        self.latency = latency
+        self.model = model or f"fake-embedding-{size}"  # nombre en la caché de embeddings
+
+    def _vector(self, text):
+        values = []
+        counter = 0
+        while len(values) < self.size:
+            digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+            values.extend(b / 127.5 - 1.0 for b in digest)
+            counter += 1
+        values = values[:self.size]
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        return self._vector(text)
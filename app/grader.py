@@ -0,0 +1,102 @@
+# app/grader.py
+# Evaluador multi-criterio: una sola llamada al LLM califica todos los criterios
+# (y opcionalmente varias respuestas) con salida JSON estructurada.
+
+import json
+import re
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+GRADER_TEMPLATE = """You are an impartial grader. Score each answer below against the reference answer, \
+giving an integer from 1 (worst) to 10 (best) for every criterion.
+
+Criteria:
+{criteria}
+
+Criteria keys: {keys}
+
+{answers}
+
+Respond only with a JSON object of the form \
+{{"results": [{{"id": <answer id>, {example}}}]}} containing one entry per answer id."""
+
+ANSWER_TEMPLATE = """[id={id}]
+Question: {question}
+Reference answer: {reference}
+Answer to grade: {prediction}"""
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    # Suma los tokens de todas las llamadas al LLM hechas con este handler
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        self.prompt_tokens += usage.get("prompt_tokens", 0)
+        self.completion_tokens += usage.get("completion_tokens", 0)
+
+
+def build_grader_prompt(items, criteria):
+    answers = "\n\n".join(
+        ANSWER_TEMPLATE.format(id=i, question=item["question"], reference=item["reference"], prediction=item["prediction"])
+        for i, item in enumerate(items)
+    )
+    return GRADER_TEMPLATE.format(
+        criteria="\n".join(f"- {name}: {description}" for name, description in criteria.items()),
+        keys=", ".join(criteria),
+        answers=answers,
+        example=", ".join(f'"{name}": <1-10>' for name in criteria),
+    )
+
+
+def _score(value):
+    # Entero 1-10 a partir de 8, 8.0, "8" o "8/10"
+    if isinstance(value, str):
+        value = value.strip().split("/")[0]
+    return min(10, max(1, round(float(value))))
+
+
+def _results(text):
+    # {id: entrada} del JSON del evaluador; vacío si la salida no se puede leer
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    try:
+        entries = json.loads(match.group(0))["results"] if match else []
+    except (ValueError, KeyError, TypeError):
+        return {}
+    results = {}
+    for entry in entries if isinstance(entries, list) else []:
+        try:
+            results[int(entry["id"])] = entry
+        except (KeyError, TypeError, ValueError):
+            continue
+    return results
+
+
+def parse_grader_output(text, n_items, criteria):
+    # Scores por item; None para los items sin calificación válida (falta el id o algún
+    # criterio, o un valor no numérico) para que el llamador los reintente o los califique aparte
+    results = _results(text)
+    scores = []
+    for i in range(n_items):
+        try:
+            scores.append({name: _score(results[i][name]) for name in criteria})
+        except (KeyError, TypeError, ValueError, OverflowError):
+            scores.append(None)
+    return scores
+
+
+def grade_batch(llm, items, criteria):
+    # items: lista de dicts con question, reference y prediction.
+    # Devuelve (scores por item, uso de tokens, latencia en segundos) de una sola llamada; el
+    # score de un item es None si el evaluador no lo calificó de forma legible.
+    handler = TokenUsageHandler()
+    prompt = build_grader_prompt(items, criteria)
+    start = time.perf_counter()
+    response = llm.bind(response_format={"type": "json_object"}).invoke(prompt, config={"callbacks": [handler]})
+    latency = time.perf_counter() - start
+    usage = {"prompt_tokens": handler.prompt_tokens, "completion_tokens": handler.completion_tokens}
+    return parse_grader_output(response.content, len(items), criteria), usage, latency
@@ -0,0 +1,190 @@
+# app/hybrid_retriever.py
+# Recuperación híbrida: índice invertido BM25 en proceso (guardado junto al índice FAISS)
+# + búsqueda vectorial, fusionadas con reciprocal rank fusion (RRF). Las consultas formadas
+# solo por identificadores (GRD, IW, S1A_IW_SLC, 440...) se resuelven solo con BM25,
+# sin llamar a la API de embeddings.
+
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Any
+
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+
+from app.tracing import stage
+
+BM25_META_FILE = "bm25.json"
+BM25_ARRAYS_FILE = "bm25.npz"
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text):
+    # Palabras en minúsculas; los identificadores con "_" también aportan sus partes
+    tokens = []
+    for word in _WORD.findall(text.lower()):
+        tokens.append(word)
+        if "_" in word:
+            tokens.extend(part for part in word.split("_") if part)
+    return tokens
+
+
+def _is_identifier(word):
+    # Tiene dígitos, está en mayúsculas o lleva "_": IW, GRD, 440, S1A_EW_SLC
+    return any(c.isdigit() for c in word) or "_" in word or (word.isupper() and len(word) > 1)
+
+
+def identifier_terms(text):
+    # Identificadores de un texto en el mismo formato que tokenize (minúsculas, partes de "_")
+    return set(tokenize(" ".join(w for w in _WORD.findall(text) if _is_identifier(w))))
+
+
+def is_keyword_query(query, max_terms=3):
+    # Consulta corta donde cada palabra parece un identificador, p. ej. "IW GRD" o "S1A_EW_SLC"
+    words = _WORD.findall(query)
+    return 0 < len(words) <= max_terms and all(_is_identifier(w) for w in words)
+
+
+class BM25Index:
+    # Listas de postings contiguas en arrays de numpy: offsets[t]:offsets[t+1] delimita los
+    # documentos (y frecuencias) del término t
+
+    def __init__(self, doc_ids, vocab, offsets, postings_doc, postings_tf, doc_len, k1=1.5, b=0.75):
+        self.doc_ids = doc_ids
+        self.vocab = vocab
+        self.offsets = offsets
+        self.postings_doc = postings_doc
+        self.postings_tf = postings_tf
+        self.doc_len = doc_len
+        self.avgdl = float(doc_len.mean()) if len(doc_len) else 0.0
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def from_texts(cls, doc_ids, texts, k1=1.5, b=0.75):
+        postings = {}
+        doc_len = np.zeros(len(texts), dtype="int32")
+        for i, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len[i] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((i, tf))
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype="int64")
+        offsets[1:] = np.cumsum([len(postings[t]) for t in terms])
+        flat = [p for t in terms for p in postings[t]]
+        postings_doc = np.array([p[0] for p in flat], dtype="int32")
+        postings_tf = np.array([min(p[1], 65535) for p in flat], dtype="uint16")
+        vocab = {t: i for i, t in enumerate(terms)}
+        return cls(list(doc_ids), vocab, offsets, postings_doc, postings_tf, doc_len, k1, b)
+
+    @classmethod
+    def from_vectorstore(cls, vectordb):
+        doc_ids = [doc_id for _, doc_id in sorted(vectordb.index_to_docstore_id.items())]
+        return cls.from_texts(doc_ids, [vectordb.docstore.search(d).page_content for d in doc_ids])
+
+    def save(self, persist_path):
+        meta_path = os.path.join(persist_path, BM25_META_FILE)
+        arrays_path = os.path.join(persist_path, BM25_ARRAYS_FILE)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "doc_ids": self.doc_ids,
+                       "terms": sorted(self.vocab, key=self.vocab.get)}, f)
+        with open(arrays_path + ".tmp", "wb") as f:
+            np.savez(f, offsets=self.offsets, postings_doc=self.postings_doc,
+                     postings_tf=self.postings_tf, doc_len=self.doc_len)
+        os.replace(meta_path + ".tmp", meta_path)
+        os.replace(arrays_path + ".tmp", arrays_path)
+
+    @classmethod
+    def load(cls, persist_path):
+        meta_path = os.path.join(persist_path, BM25_META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        arrays = np.load(os.path.join(persist_path, BM25_ARRAYS_FILE))
+        vocab = {t: i for i, t in enumerate(meta["terms"])}
+        return cls(meta["doc_ids"], vocab, arrays["offsets"], arrays["postings_doc"],
+                   arrays["postings_tf"], arrays["doc_len"], meta["k1"], meta["b"])
+
+    def search(self, query, k=4):
+        # [(doc_id, score)] de mayor a menor, solo documentos con algún término de la consulta
+        n_docs = len(self.doc_ids)
+        scores = np.zeros(n_docs, dtype="float32")
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            start, end = self.offsets[t], self.offsets[t + 1]
+            docs = self.postings_doc[start:end]
+            tf = self.postings_tf[start:end].astype("float32")
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / self.avgdl)
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm)
+        hits = np.flatnonzero(scores)
+        top = hits[np.argsort(-scores[hits], kind="stable")[:k]]
+        return [(self.doc_ids[i], float(scores[i])) for i in top]
+
+
+class HybridRetriever(BaseRetriever):
+    # mode: "hybrid" (BM25 + FAISS con RRF), "bm25" (sin embeddings) o "vector" (solo FAISS)
+    vectorstore: Any
+    bm25: Any = None
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+    mode: str = "hybrid"
+
+    def _vector_ids(self, query, k):
+        with stage("embed"):
+            embedding = np.array([self.vectorstore.embeddings.embed_query(query)], dtype="float32")
+        with stage("faiss_search"):
+            _, indices = self.vectorstore.index.search(embedding, k)
+        return [self.vectorstore.index_to_docstore_id[i] for i in indices[0] if i >= 0]
+
+    def _keyword_ids(self, query):
+        if self.mode == "vector":
+            return []
+        with stage("bm25_search"):
+            return [doc_id for doc_id, _ in self.bm25.search(query, self.fetch_k)]
+
+    def _needs_vectors(self, query, keyword_ids):
+        return self.mode == "vector" or (self.mode == "hybrid" and not (keyword_ids and is_keyword_query(query)))
+
+    def _select(self, keyword_ids, vector_ids):
+        if vector_ids is None:
+            ids = keyword_ids[:self.k]
+        elif self.mode == "vector":
+            ids = vector_ids[:self.k]
+        else:
+            fused = {}
+            for ranking in (keyword_ids, vector_ids):
+                for rank, doc_id in enumerate(ranking):
+                    fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+            ids = sorted(fused, key=fused.get, reverse=True)[:self.k]
+        return [self.vectorstore.docstore.search(doc_id) for doc_id in ids]
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        keyword_ids = self._keyword_ids(query)
+        vector_ids = None
+        if self._needs_vectors(query, keyword_ids):
+            vector_ids = self._vector_ids(query, self.k if self.mode == "vector" else self.fetch_k)
+        return self._select(keyword_ids, vector_ids)
+
+    def retrieve_batch(self, queries):
+        # Varias consultas juntas: un solo embed_documents y una búsqueda FAISS matricial
+        keyword = [self._keyword_ids(query) for query in queries]
+        pending = [i for i, query in enumerate(queries) if self._needs_vectors(query, keyword[i])]
+        vector = {}
+        if pending:
+            with stage("embed"):
+                embeddings = self.vectorstore.embeddings.embed_documents([queries[i] for i in pending])
+            with stage("faiss_search"):
+                k = self.k if self.mode == "vector" else self.fetch_k
+                _, indices = self.vectorstore.index.search(np.array(embeddings, dtype="float32"), k)
+            for i, row in zip(pending, indices):
+                vector[i] = [self.vectorstore.index_to_docstore_id[j] for j in row if j >= 0]
+        return [self._select(keyword[i], vector.get(i)) for i in range(len(queries))]
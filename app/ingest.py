@@ -0,0 +1,246 @@
+# app/ingest.py
+# Camino de ingesta: parseo de PDFs, split, embeddings y escritura del índice FAISS con su
+# manifest y su índice BM25. Vive aparte de rag_pipeline para que el camino de consulta
+# (UIs, servicio, evaluaciones) no cargue pypdf, el text splitter ni MLflow.
+
+import os
+import json
+import time
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import faiss
+import numpy as np
+import mlflow
+from pypdf import PdfReader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+
+from app.docstore import save_local, vectors_path
+from app.hybrid_retriever import BM25_META_FILE, BM25Index
+from app.rag_pipeline import (
+    DATA_DIR, EMBED_CONCURRENCY, INDEX_SPEC, MANIFEST_FILE, VECTOR_DIR, apply_search_params, corpus_sha256, file_sha256,
+    get_embeddings, load_manifest, load_vectorstore_from_disk, parse_index_spec,
+)
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", 16))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 256))
+INDEX_TRAIN_SIZE = int(os.getenv("INDEX_TRAIN_SIZE", 50_000))
+
+# --- Ingesta de PDFs en streaming ---
+# Cada PDF se divide en tareas de INGEST_PAGES_PER_TASK páginas que se parsean en un pool de
+# procesos; como mucho hay 2 tareas en vuelo por worker, así la memoria no crece con el corpus.
+
+def _parse_pages(task):
+    # Mismo texto por página que PyPDFLoader (modo "page") y metadatos equivalentes
+    path, start, end = task
+    reader = PdfReader(path)
+    doc_metadata = {key.lstrip("/").lower(): str(value) for key, value in (reader.metadata or {}).items()}
+    doc_metadata.update({"source": path, "total_pages": len(reader.pages)})
+    pages = []
+    for i in range(start, end):
+        metadata = {**doc_metadata, "page": i, "page_label": reader.page_labels[i]}
+        pages.append(Document(page_content=reader.pages[i].extract_text().strip(), metadata=metadata))
+    return path, pages
+
+def _page_tasks(paths):
+    for path in paths:
+        total = len(PdfReader(path).pages)
+        for start in range(0, total, INGEST_PAGES_PER_TASK):
+            yield path, start, min(start + INGEST_PAGES_PER_TASK, total)
+
+def iter_pdf_pages(paths, workers=INGEST_WORKERS):
+    # Genera (ruta, páginas) en orden de archivo y página
+    tasks = _page_tasks(paths)
+    if workers <= 1:
+        for task in tasks:
+            yield _parse_pages(task)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(_parse_pages, task))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def iter_documents(path=DATA_DIR):
+    files = sorted(f for f in os.listdir(path) if f.endswith(".pdf"))
+    for _, pages in iter_pdf_pages([os.path.join(path, f) for f in files]):
+        yield from pages
+
+def load_documents(path=DATA_DIR):
+    return list(iter_documents(path))
+
+def chunk_ids(file_name, chunks):
+    # Id estable por contenido: mismo archivo + página + texto => mismo id
+    ids, seen = [], {}
+    for chunk in chunks:
+        page = chunk.metadata.get("page", 0)
+        key = hashlib.sha256(f"{file_name}\n{page}\n{chunk.page_content}".encode("utf-8")).hexdigest()
+        n = seen.get(key, 0)
+        seen[key] = n + 1
+        ids.append(key if n == 0 else f"{key}-{n}")
+    return ids
+
+def write_manifest(manifest, persist_path=VECTOR_DIR):
+    manifest_path = os.path.join(persist_path, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+# --- Tipos de índice FAISS (ver parse_index_spec en rag_pipeline) ---
+
+def build_faiss_index(vectors, index_spec, train_size=INDEX_TRAIN_SIZE):
+    # Los índices IVF/PQ se entrenan con una muestra de los vectores antes de agregarlos
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    index = faiss.index_factory(vectors.shape[1], parse_index_spec(index_spec)[0])
+    if not index.is_trained:
+        sample = vectors
+        if len(vectors) > train_size:
+            sample = vectors[np.random.default_rng(0).choice(len(vectors), train_size, replace=False)]
+        try:
+            index.train(sample)
+        except RuntimeError as e:
+            raise ValueError(f"No se pudo entrenar el índice '{index_spec}' con {len(sample)} vectores: {e}") from e
+    index.add(vectors)
+    return apply_search_params(index, index_spec)
+
+def reindex_vectorstore(vectordb, index_spec, embeddings, drop_ids=()):
+    # Reconstruye el índice con otro tipo conservando docstore e ids. Los vectores salen del
+    # índice plano si se puede, o de la caché de embeddings (sin llamadas nuevas a la API)
+    drop = set(drop_ids)
+    ids = [doc_id for _, doc_id in sorted(vectordb.index_to_docstore_id.items()) if doc_id not in drop]
+    docs = {doc_id: vectordb.docstore.search(doc_id) for doc_id in ids}
+    if isinstance(vectordb.index, faiss.IndexFlat) and not drop:
+        vectors = vectordb.index.reconstruct_n(0, vectordb.index.ntotal)
+    else:
+        vectors = np.array(embeddings.embed_documents([docs[doc_id].page_content for doc_id in ids]), dtype="float32")
+    index = build_faiss_index(vectors, index_spec)
+    return FAISS(embeddings, index, InMemoryDocstore(docs), dict(enumerate(ids)))
+
+def save_vectorstore(chunk_size=512, chunk_overlap=50, persist_path=VECTOR_DIR, data_path=DATA_DIR,
+                     index_spec=INDEX_SPEC, embeddings=None):
+    # embeddings: por defecto los de get_embeddings (caché + planificador sobre OpenAI)
+    embeddings = embeddings or get_embeddings(max_batch_size=EMBED_BATCH_SIZE)
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        add_start_index=True,  # permite unir chunks contiguos al armar el contexto
+    )
+    settings = {
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "embedding_model": embeddings.model,
+        "index_spec": index_spec,
+    }
+
+    # Reutilizar el índice existente solo si se construyó con la misma configuración
+    manifest = load_manifest(persist_path)
+    if manifest:
+        manifest.setdefault("index_spec", "Flat")  # manifiestos anteriores a los tipos de índice
+    vectordb = None
+    if (
+        manifest
+        and all(manifest.get(k) == v for k, v in settings.items())
+        and vectors_path(persist_path)
+    ):
+        vectordb = load_vectorstore_from_disk(persist_path, embeddings=embeddings)
+    else:
+        manifest = {"files": {}}
+    indexed_ids = set(vectordb.index_to_docstore_id.values()) if vectordb else set()
+
+    files = {}
+    wanted_ids = set()
+    changed = []
+    for file in sorted(os.listdir(data_path)):
+        if not file.endswith(".pdf"):
+            continue
+        file_path = os.path.join(data_path, file)
+        sha = file_sha256(file_path)
+        previous = manifest["files"].get(file)
+        if previous and previous["sha256"] == sha and indexed_ids.issuperset(previous["chunks"]):
+            files[file] = previous
+            wanted_ids.update(previous["chunks"])
+        else:
+            files[file] = {"sha256": sha, "pages": 0, "chunks": []}
+            changed.append(file_path)
+
+    def add_batch(vectordb, chunks, ids):
+        if vectordb is None:
+            return FAISS.from_documents(chunks, embedding=embeddings, ids=ids)
+        vectordb.add_documents(chunks, ids=ids)
+        return vectordb
+
+    # Archivos nuevos o modificados: las páginas llegan en streaming desde el pool de procesos,
+    # se dividen y los chunks nuevos se embeben por ventanas de EMBED_CONCURRENCY lotes de
+    # EMBED_BATCH_SIZE, que el planificador envía en paralelo
+    window = EMBED_BATCH_SIZE * max(1, EMBED_CONCURRENCY)
+    new_chunks, new_ids = [], []
+    n_embedded = 0
+    for file_path, pages in iter_pdf_pages(changed):
+        file = os.path.basename(file_path)
+        chunks = splitter.split_documents(pages)
+        ids = chunk_ids(file, chunks)
+        files[file]["pages"] += len(pages)
+        files[file]["chunks"].extend(ids)
+        wanted_ids.update(ids)
+        for chunk_id, chunk in zip(ids, chunks):
+            if chunk_id not in indexed_ids:
+                new_chunks.append(chunk)
+                new_ids.append(chunk_id)
+        if len(new_chunks) >= window:
+            vectordb = add_batch(vectordb, new_chunks, new_ids)
+            n_embedded += len(new_ids)
+            new_chunks, new_ids = [], []
+    if new_chunks:
+        vectordb = add_batch(vectordb, new_chunks, new_ids)
+        n_embedded += len(new_ids)
+
+    n_parsed = len(changed)
+    removed_ids = sorted(indexed_ids - wanted_ids)
+    n_reused = len(wanted_ids) - n_embedded
+
+    if vectordb is None:
+        raise ValueError(f"No se encontraron PDFs en {data_path}")
+    # Los chunks nuevos se agregan como índice plano; si el spec no es Flat, el índice se
+    # reconstruye (y reentrena) cuando cambia el contenido. HNSW no admite borrar vectores.
+    build_start = time.perf_counter()
+    if parse_index_spec(index_spec)[0] != "Flat" and (n_embedded or removed_ids):
+        vectordb = reindex_vectorstore(vectordb, index_spec, embeddings, drop_ids=removed_ids)
+    elif removed_ids:
+        vectordb.delete(removed_ids)
+    index_build_s = time.perf_counter() - build_start
+    save_local(vectordb, persist_path)
+
+    # Índice invertido BM25 para la recuperación híbrida, junto al índice FAISS
+    if n_embedded or removed_ids or not os.path.exists(os.path.join(persist_path, BM25_META_FILE)):
+        BM25Index.from_vectorstore(vectordb).save(persist_path)
+
+    corpus = corpus_sha256(data_path)
+    write_manifest({**settings, "corpus_sha256": corpus, "files": files}, persist_path)
+
+    mlflow.set_experiment("vectorstore_tracking")
+    with mlflow.start_run(run_name="vectorstore_build"):
+        mlflow.log_param("chunk_size", chunk_size)
+        mlflow.log_param("chunk_overlap", chunk_overlap)
+        mlflow.log_param("index_spec", index_spec)
+        mlflow.log_param("n_chunks", len(wanted_ids))
+        mlflow.log_param("n_docs", sum(info["pages"] for info in files.values()))
+        mlflow.log_metric("n_files_parsed", n_parsed)
+        mlflow.log_metric("n_chunks_reused", n_reused)
+        mlflow.log_metric("n_chunks_embedded", n_embedded)
+        mlflow.log_metric("n_chunks_removed", len(removed_ids))
+        mlflow.log_metric("index_build_s", index_build_s)
+        mlflow.log_metrics(embeddings.stats())
+        mlflow.set_tag("vectorstore", persist_path)
+        mlflow.set_tag("corpus_sha256", corpus)
+
+    print(f"♻️ Chunks reutilizados: {n_reused} | 🧮 Embebidos: {n_embedded} | 🗑️ Eliminados: {len(removed_ids)}")
+    return vectordb
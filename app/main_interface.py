@@ -6,32 +6,65 @@ import streamlit as st
 st.set_page_config(page_title="📚 Chatbot GenAI + Métricas", layout="wide")
 
 import pandas as pd
-import mlflow
 import json
-from app.rag_pipeline import load_vectorstore_from_disk, build_chain
+import uuid
+from app.rag_pipeline import answer_stream, coordinator, prepare_chat_history, trace_sink, warm_up
 
-import matplotlib.pyplot as plt
 import numpy as np
 
-modo = st.sidebar.radio("Selecciona una vista:", ["🤖🛰️ Chatbot", "📊 Traditional Metrics","📊 Semantic Metrics","📊 Metrics by Experiment"])
+@st.cache_resource(show_spinner=False)
+def precargar():
+    # Una vez por proceso: índice y cadena se cargan mientras se muestra la página
+    return warm_up()
 
-vectordb = load_vectorstore_from_disk()
-chain = build_chain(vectordb)
+precargar()
+
+@st.cache_data(ttl=10, show_spinner=False)
+def cargar_resultados():
+    # Snapshot local de los runs "eval_*": solo se sincronizan los runs nuevos
+    from app.results_store import sync, load_results
+    sync()
+    return load_results()
+
+modo = st.sidebar.radio("Selecciona una vista:", ["🤖🛰️ Chatbot", "📊 Traditional Metrics","📊 Semantic Metrics","📊 Metrics by Experiment", "⏱️ Latency"])
 
 if modo == "🤖🛰️ Chatbot":
     st.title("🤖🛰️ Satellite Assistant")
-    pregunta = st.text_input("What do you want to know? / ¿Qué deseas consultar? / 何をお知りになりたいですか？ ")
+    # En un formulario la consulta sale solo al enviarlo (botón o Enter), no en cada re-ejecución
+    # del script; así se puede repetir la misma pregunta o reintentarla tras un error
+    with st.form("pregunta"):
+        pregunta = st.text_input("What do you want to know? / ¿Qué deseas consultar? / 何をお知りになりたいですか？ ")
+        enviada = st.form_submit_button("Ask")
 
     if "chat_history" not in st.session_state:
         st.session_state.chat_history = []
-
-    if pregunta:
-        with st.spinner("Reading docs..."):
-            result = chain.invoke({"question": pregunta, "chat_history": st.session_state.chat_history})
-            st.session_state.chat_history.append((pregunta, result["answer"]))
-
-    if st.session_state.chat_history:
-        for q, a in reversed(st.session_state.chat_history):
+        st.session_state.latencias = []
+        st.session_state.resumen = {}
+        st.session_state.session_id = uuid.uuid4().hex  # turnos y límite por sesión en el coordinador
+
+    historial = st.session_state.chat_history
+    if enviada and pregunta.strip():
+        st.markdown(f"**👤 User:** {pregunta}")
+        placeholder = st.empty()
+        tiempos = {}
+        respuesta = ""
+        # La respuesta se muestra token a token; al modelo solo llega el historial acotado
+        contexto = prepare_chat_history(pregunta, historial, st.session_state.resumen)
+        for token in answer_stream(pregunta, contexto, tiempos, session_id=st.session_state.session_id):
+            respuesta += token
+            placeholder.markdown(f"**🤖 Bot:** {respuesta}▌")
+        placeholder.markdown(f"**🤖 Bot:** {respuesta}")
+        origen = " · 💾 cached" if tiempos.get("cache_hit") else " · 🔗 shared" if tiempos.get("coalesced") else ""
+        if tiempos.get("queue_s", 0) >= 0.1:
+            origen += f" · ⏳ queued {tiempos['queue_s']:.2f}s"
+        st.caption(f"⏱️ First token: {tiempos.get('ttft_s', 0):.2f}s · Total: {tiempos['total_s']:.2f}s{origen}")
+        st.markdown("---")
+        historial = list(historial)
+        st.session_state.chat_history.append((pregunta, respuesta))
+        st.session_state.latencias.append(tiempos)
+
+    if historial:
+        for q, a in reversed(historial):
             st.markdown(f"**👤 User:** {q}")
             st.markdown(f"**🤖 Bot:** {a}")
             st.markdown("---")
@@ -39,34 +72,31 @@ if modo == "🤖🛰️ Chatbot":
 elif modo == "📊 Traditional Metrics":
     st.title("📈 Evaluation Results")
 
-    client = mlflow.tracking.MlflowClient()
-    experiments = [exp for exp in client.search_experiments() if exp.name.startswith("eval_")]
+    from app.results_store import list_experiments, metric_column
+    import matplotlib.pyplot as plt
+
+    resultados = cargar_resultados()
+    exp_names = list_experiments()
 
-    if not experiments:
+    if not exp_names:
         st.warning("Not experiments found.")
         st.stop()
 
-    exp_names = [exp.name for exp in experiments]
     selected_exp = st.selectbox("Select an experiment:", exp_names)
 
-    experiment = client.get_experiment_by_name(selected_exp)
-    runs = client.search_runs(experiment_ids=[experiment.experiment_id], order_by=["start_time DESC"])
+    runs = resultados[resultados["experiment"] == selected_exp]
 
-    if not runs:
+    if runs.empty:
         st.warning("No executions found.")
         st.stop()
 
     # Armar dataframe
-    data = []
-    for run in runs:
-        params = run.data.params
-        metrics = run.data.metrics
-        data.append({
-            "Pregunta": params.get("question"),
-            "Prompt": params.get("prompt_version"),
-            "Chunk Size": int(params.get("chunk_size", 0)),
-            "Correcto (LC)": metrics.get("lc_is_correct", 0)
-        })
+    data = pd.DataFrame({
+        "Pregunta": runs["question"],
+        "Prompt": runs["prompt_version"],
+        "Chunk Size": runs["chunk_size"],
+        "Correcto (LC)": metric_column(runs, "lc_is_correct")
+    }).reset_index(drop=True)
 
     df = pd.DataFrame(data)
     st.dataframe(df)
@@ -83,37 +113,34 @@ elif modo == "📊 Traditional Metrics":
 elif modo == "📊 Semantic Metrics":
     st.title("📈 Evaluation Results")
 
-    client = mlflow.tracking.MlflowClient()
-    experiments = [exp for exp in client.search_experiments() if exp.name.startswith("eval_")]
+    from app.results_store import list_experiments, metric_column
+    import matplotlib.pyplot as plt
 
-    if not experiments:
+    resultados = cargar_resultados()
+    exp_names = list_experiments()
+
+    if not exp_names:
         st.warning("Not experiments found.")
         st.stop()
 
-    exp_names = [exp.name for exp in experiments]
     selected_exp = st.selectbox("Select an experiment:", exp_names)
 
-    experiment = client.get_experiment_by_name(selected_exp)
-    runs = client.search_runs(experiment_ids=[experiment.experiment_id], order_by=["start_time DESC"])
+    runs = resultados[resultados["experiment"] == selected_exp]
 
-    if not runs:
+    if runs.empty:
         st.warning("No executions found.")
         st.stop()
 
     # Armar dataframe
-    data = []
-    for run in runs:
-        params = run.data.params
-        metrics = run.data.metrics
-        data.append({
-            "Pregunta": params.get("question"),
-            "Prompt": params.get("prompt_version"),
-            "Chunk Size": int(params.get("chunk_size", 0)),
-            "Coherence": metrics.get("coherence_score", 0),
-            "Correctness": metrics.get("correctness_score", 0),
-            "Harmfulness": metrics.get("harmfulness_score", 0),
-            "Relevance": metrics.get("relevance_score", 0),
-            "Toxicity": metrics.get("toxicity_score", 0)})
+    data = pd.DataFrame({
+        "Pregunta": runs["question"],
+        "Prompt": runs["prompt_version"],
+        "Chunk Size": runs["chunk_size"],
+        "Coherence": metric_column(runs, "coherence_score"),
+        "Correctness": metric_column(runs, "correctness_score"),
+        "Harmfulness": metric_column(runs, "harmfulness_score"),
+        "Relevance": metric_column(runs, "relevance_score"),
+        "Toxicity": metric_column(runs, "toxicity_score")}).reset_index(drop=True)
 
     df = pd.DataFrame(data)
     st.dataframe(df)
@@ -169,39 +196,35 @@ elif modo == "📊 Semantic Metrics":
 elif modo == "📊 Metrics by Experiment":
     st.title("📈 Evaluation Summary by Experiment")
 
-    client = mlflow.tracking.MlflowClient()
-    experiments = [exp for exp in client.search_experiments() if exp.name.startswith("eval_")]
+    from app.results_store import list_experiments, metric_column
+    import matplotlib.pyplot as plt
+
+    resultados = cargar_resultados()
+    exp_names = list_experiments()
 
-    if not experiments:
+    if not exp_names:
         st.warning("No experiments found.")
         st.stop()
 
-    exp_names = [exp.name for exp in experiments]
     selected_exps = st.multiselect("Select one or more experiments:", exp_names)
 
     if not selected_exps:
         st.info("Please select at least one experiment.")
         st.stop()
 
-    # Leer y acumular runs de todos los experimentos seleccionados
-    all_data = []
-    for exp_name in selected_exps:
-        experiment = client.get_experiment_by_name(exp_name)
-        runs = client.search_runs(experiment_ids=[experiment.experiment_id], order_by=["start_time DESC"])
-        for run in runs:
-            params = run.data.params
-            metrics = run.data.metrics
-            all_data.append({
-                "Experiment": exp_name,
-                "Pregunta": params.get("question"),
-                "Prompt": params.get("prompt_version"),
-                "Chunk Size": int(params.get("chunk_size", 0)),
-                "Coherence": metrics.get("coherence_score", 0),
-                "Correctness": metrics.get("correctness_score", 0),
-                "Harmfulness": metrics.get("harmfulness_score", 0),
-                "Relevance": metrics.get("relevance_score", 0),
-                "Toxicity": metrics.get("toxicity_score", 0)
-            })
+    # Runs de todos los experimentos seleccionados (desde el snapshot local)
+    runs = resultados[resultados["experiment"].isin(selected_exps)]
+    all_data = pd.DataFrame({
+        "Experiment": runs["experiment"],
+        "Pregunta": runs["question"],
+        "Prompt": runs["prompt_version"],
+        "Chunk Size": runs["chunk_size"],
+        "Coherence": metric_column(runs, "coherence_score"),
+        "Correctness": metric_column(runs, "correctness_score"),
+        "Harmfulness": metric_column(runs, "harmfulness_score"),
+        "Relevance": metric_column(runs, "relevance_score"),
+        "Toxicity": metric_column(runs, "toxicity_score")
+    }).reset_index(drop=True)
 
     df = pd.DataFrame(all_data)
 
@@ -243,4 +266,62 @@ elif modo == "📊 Metrics by Experiment":
     ax.legend(title="Criterion", facecolor="black", edgecolor="gray", labelcolor="white", title_fontsize=10, fontsize=9)
 
     plt.tight_layout()
-    st.pyplot(fig)
\ No newline at end of file
+    st.pyplot(fig)
+
+
+elif modo == "⏱️ Latency":
+    st.title("⏱️ Chat Latency by Stage")
+
+    # Trazas de las respuestas del chatbot (ambas UIs) guardadas por rag_pipeline.answer_stream
+    trazas = trace_sink.read(limit=1000)
+    if not trazas:
+        st.warning("No traced chat requests yet.")
+        st.stop()
+
+    df = pd.DataFrame(trazas)
+    etapas = [c for c in ["queue_s", "condense_s", "retrieval_s", "embed_s", "bm25_search_s", "faiss_search_s", "rerank_s",
+                          "generate_s", "ttft_s", "total_s"] if c in df]
+    resumen = pd.DataFrame({
+        "p50": df[etapas].quantile(0.50),
+        "p95": df[etapas].quantile(0.95),
+        "p99": df[etapas].quantile(0.99),
+        "requests": df[etapas].count(),
+    })
+
+    st.subheader(f"📋 Percentiles (seconds, last {len(df)} requests)")
+    st.dataframe(resumen)
+
+    st.subheader("📊 p50 / p95 per stage")
+    st.bar_chart(resumen[["p50", "p95"]])
+
+    conteos = [c for c in ["generate_prompt_tokens", "generate_completion_tokens", "n_docs"] if c in df]
+    if conteos:
+        st.subheader("🔢 Tokens and retrieved chunks (average per request)")
+        st.dataframe(df[conteos].mean().rename("avg").to_frame())
+    if "cache_hit" in df:
+        st.metric("💾 Semantic cache hit rate", f"{df['cache_hit'].fillna(False).astype(bool).mean():.0%}")
+    if "coalesced" in df:
+        st.metric("🔗 Requests sharing an in-flight answer", f"{df['coalesced'].fillna(False).astype(bool).mean():.0%}")
+
+    # Estado actual del coordinador de este proceso (cola, generaciones en curso, esperas)
+    st.subheader("🚦 Request coordinator (this process)")
+    estado = coordinator.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Running", estado["running"])
+    col2.metric("Queued", estado["queue_depth"])
+    col3.metric("Queue wait p95", f"{estado['queue_wait_p95_s']:.2f}s")
+    col4.metric("Coalesced", f"{estado['coalesced']}/{estado['requests']}")
+    st.caption(f"Upstream LLM calls: {estado['upstream']} · Rate-limited: {estado['rate_limited']} · "
+               f"Sessions waiting: {estado['sessions_waiting']}")
+
+    st.subheader("📈 Total latency histogram")
+    import matplotlib.pyplot as plt
+    plt.style.use("dark_background")
+    fig, ax = plt.subplots(figsize=(10, 4), facecolor='black')
+    ax.hist(df["total_s"].dropna(), bins=30, color="#1f77b4")
+    ax.set_facecolor("black")
+    ax.set_xlabel("Total (s)", color="white")
+    ax.set_ylabel("Requests", color="white")
+    ax.tick_params(colors="white")
+    plt.tight_layout()
+    st.pyplot(fig)
@@ -1,82 +1,601 @@
 # app/rag_pipeline.py
+# Camino de consulta: carga de índices, recuperación, cadenas y respuestas. La ingesta
+# (parseo de PDFs y construcción de índices) está en app/ingest.py. Las dependencias
+# pesadas (langchain_openai, langchain_community, faiss, cadenas de langchain) se importan
+# dentro de las funciones que las usan, así importar este módulo es rápido.
 
 import os
+import json
+import time
+import hashlib
+import pickle
+import threading
+import weakref
 from langchain.globals import set_verbose, get_verbose
 
 set_verbose(True)  # Si quieres ver logs detallados
 
-from langchain_openai import OpenAIEmbeddings
-from langchain_openai import ChatOpenAI
-
-from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.prompts import PromptTemplate
-from langchain.chains import ConversationalRetrievalChain
-
 from dotenv import load_dotenv
-import mlflow
+
+from app.embedding_cache import CachedEmbeddings
+from app.embedding_scheduler import ScheduledEmbeddings
+from app.context_budget import BudgetedRetriever
+from app.hybrid_retriever import BM25Index, HybridRetriever, is_keyword_query
+from app.request_coordinator import RequestCoordinator
+from app.rerank import SCORERS, RerankRetriever
+from app.tracing import LocalTraceSink, Trace, activate, stage
 
 load_dotenv()
 
 DATA_DIR = "data/pdfs"
 PROMPT_DIR = "app/prompts"
 VECTOR_DIR = "vectorstore"
+MANIFEST_FILE = "manifest.json"
+REGISTRY_DIR = os.path.join(VECTOR_DIR, "indexes")
+REGISTRY_FILE = os.path.join(VECTOR_DIR, "registry.json")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(VECTOR_DIR, "embedding_cache.sqlite"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 200_000))
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", 4))
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", 1000))
+HISTORY_SUMMARY = os.getenv("HISTORY_SUMMARY", "0") == "1"
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 4))
+EMBED_MAX_BATCH_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", 100_000))
+EMBED_RPM = int(os.getenv("EMBED_RPM", 3000))
+EMBED_TPM = int(os.getenv("EMBED_TPM", 1_000_000))
+INDEX_SPEC = os.getenv("INDEX_SPEC", "Flat")
+ALLOW_PICKLE_INDEX = os.getenv("ALLOW_PICKLE_INDEX", "0") == "1"  # leer índices index.pkl (formato anterior)
+RETRIEVER_MODE = os.getenv("RETRIEVER_MODE", "hybrid")  # hybrid | vector | bm25
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", 4))
+RERANK = os.getenv("RERANK", "off")  # off | lexical | mmr | cross_encoder
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", 20))
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", 1500))  # 0 desactiva el armado del contexto
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", 0.8))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_TTL_S = float(os.getenv("SEMANTIC_CACHE_TTL_S", 86400))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 1000))
+SEMANTIC_CACHE_LOG_EVERY = int(os.getenv("SEMANTIC_CACHE_LOG_EVERY", 100))
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", 8))
+CHAT_SESSION_RPM = int(os.getenv("CHAT_SESSION_RPM", 10))  # 0 desactiva el límite por sesión
+CHAT_SESSION_BURST = int(os.getenv("CHAT_SESSION_BURST", 3))
+CHAT_QUEUE_TIMEOUT_S = float(os.getenv("CHAT_QUEUE_TIMEOUT_S", 0))  # 0 espera turno sin límite
+
+_encoding = None
 
-def load_documents(path=DATA_DIR):
-    docs = []
-    for file in os.listdir(path):
-        if file.endswith(".pdf"):
-            loader = PyPDFLoader(os.path.join(path, file))
-            docs.extend(loader.load())
-    return docs
-
-def save_vectorstore(chunk_size=512, chunk_overlap=50, persist_path=VECTOR_DIR):
-    docs = load_documents()
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap
+def count_tokens(text):
+    # tiktoken si está disponible (dependencia de langchain_openai); si no, o si no se puede
+    # descargar el encoding (sin red), ~4 caracteres por token
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+def get_embeddings(model=None, cache_path=EMBEDDING_CACHE_PATH, max_batch_size=1000, backend=None):
+    # Todos los embeddings (índices, evaluaciones y UIs) pasan por la misma caché en disco;
+    # los que faltan se piden en lotes con límites de rate (ver app/embedding_scheduler.py).
+    # backend reemplaza a OpenAIEmbeddings (embeddings locales del benchmark y los tests); la
+    # caché se separa por modelo, así que el de un backend propio sale de backend.model
+    if backend is None:
+        from langchain_openai import OpenAIEmbeddings
+        model = model or EMBEDDING_MODEL
+        backend = OpenAIEmbeddings(model=model)
+    else:
+        model = model or getattr(backend, "model", None)
+        if not model:
+            raise ValueError(f"{type(backend).__name__} no tiene atributo model: pasar model= para separar su caché")
+
+    scheduler = ScheduledEmbeddings(
+        backend,
+        max_batch_tokens=EMBED_MAX_BATCH_TOKENS,
+        max_batch_size=max_batch_size,
+        max_concurrency=EMBED_CONCURRENCY,
+        rpm=EMBED_RPM,
+        tpm=EMBED_TPM,
+        count_tokens=count_tokens,
     )
-    chunks = splitter.split_documents(docs)
-    embeddings = OpenAIEmbeddings()
-    vectordb = FAISS.from_documents(chunks, embedding=embeddings)
-    vectordb.save_local(persist_path)
-
-    mlflow.set_experiment("vectorstore_tracking")
-    with mlflow.start_run(run_name="vectorstore_build"):
-        mlflow.log_param("chunk_overlap", chunk_overlap)
-        mlflow.log_param("n_chunks", len(chunks))
-        mlflow.log_param("n_docs", len(docs))
-        mlflow.set_tag("vectorstore", persist_path)
-
-def load_vectorstore(chunk_size=512, chunk_overlap=50):
-    docs = load_documents()
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap
+    return CachedEmbeddings(
+        scheduler,
+        cache_path=cache_path,
+        model=model,
+        max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+    )
+
+_file_hashes = {}
+
+def file_sha256(path):
+    # Memoizado por (ruta, tamaño, mtime) para no releer PDFs sin cambios
+    stat = os.stat(path)
+    cache_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if cache_key not in _file_hashes:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        _file_hashes[cache_key] = h.hexdigest()
+    return _file_hashes[cache_key]
+
+def corpus_sha256(data_path=DATA_DIR):
+    files = sorted(f for f in os.listdir(data_path) if f.endswith(".pdf"))
+    return hashlib.sha256(
+        "\n".join(f"{name}:{file_sha256(os.path.join(data_path, name))}" for name in files).encode("utf-8")
+    ).hexdigest()
+
+def load_manifest(persist_path=VECTOR_DIR):
+    manifest_path = os.path.join(persist_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+# --- Tipos de índice FAISS ---
+# Un spec es una cadena de faiss.index_factory ("Flat", "IVF1024,Flat", "HNSW32", "IVF1024,PQ32")
+# con parámetros de búsqueda opcionales tras "|", p. ej. "IVF1024,Flat|nprobe=16" o "HNSW32|efSearch=64".
+
+def parse_index_spec(index_spec):
+    factory, _, search_params = index_spec.partition("|")
+    return factory.strip(), search_params.strip()
+
+def apply_search_params(index, index_spec):
+    search_params = parse_index_spec(index_spec)[1]
+    if search_params:
+        import faiss
+        faiss.ParameterSpace().set_index_parameters(index, search_params)
+    return index
+
+def index_key(chunk_size, chunk_overlap, embedding_model, corpus, index_spec="Flat"):
+    key = f"cs{chunk_size}_co{chunk_overlap}_{embedding_model}_{corpus[:12]}"
+    if index_spec != "Flat":
+        key += "_" + "".join(c if c.isalnum() else "-" for c in index_spec)
+    return key
+
+def load_registry():
+    if not os.path.exists(REGISTRY_FILE):
+        return {}
+    with open(REGISTRY_FILE, "r") as f:
+        return json.load(f)
+
+def register_index(key, entry):
+    registry = load_registry()
+    registry[key] = entry
+    tmp_path = REGISTRY_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(registry, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, REGISTRY_FILE)
+
+_loaded_indexes = {}
+_bm25_indexes = weakref.WeakKeyDictionary()  # vectorstore -> BM25Index
+
+def load_vectorstore(chunk_size=512, chunk_overlap=50, data_path=DATA_DIR, index_spec=INDEX_SPEC):
+    # Registro de índices: cada (chunk_size, chunk_overlap, modelo, corpus, tipo de índice) se
+    # construye una sola vez en su propio directorio y después se abre en modo consulta: Flat
+    # (.npy) e IVF quedan mapeados desde disco; HNSW se copia a memoria (faiss 1.7.4)
+    corpus = corpus_sha256(data_path)
+    key = index_key(chunk_size, chunk_overlap, EMBEDDING_MODEL, corpus, index_spec)
+    if key in _loaded_indexes:
+        return _loaded_indexes[key]
+
+    persist_path = os.path.join(REGISTRY_DIR, key)
+    if not os.path.exists(os.path.join(persist_path, MANIFEST_FILE)):
+        print(f"🏗️ Construyendo índice {key}")
+        from app.ingest import save_vectorstore
+        save_vectorstore(chunk_size, chunk_overlap, persist_path=persist_path, data_path=data_path,
+                         index_spec=index_spec)
+        register_index(key, {
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "embedding_model": EMBEDDING_MODEL,
+            "index_spec": index_spec,
+            "corpus_sha256": corpus,
+            "path": persist_path,
+            "built_at": time.time(),
+        })
+
+    vectordb = load_vectorstore_from_disk(persist_path, mmap=True)
+    _loaded_indexes[key] = vectordb
+    return vectordb
+
+def load_vectorstore_from_disk(persist_path=VECTOR_DIR, embeddings=None, mmap=False):
+    # mmap=True es el camino de consulta (solo lectura): los vectores se mapean desde disco sin
+    # copiarse a memoria (ver app/docstore.py) y los chunks se leen por id del docstore SQLite al
+    # buscarlos. Sin mmap todo se carga en memoria para poder agregar o borrar chunks (ingesta).
+    from langchain_community.vectorstores import FAISS
+    from app.docstore import LEGACY_FILE, load_docstore, open_docstore, read_format, read_index
+
+    embeddings = embeddings or get_embeddings()
+    fmt = read_format(persist_path)
+    if fmt is None and not ALLOW_PICKLE_INDEX:
+        raise ValueError(
+            f"{persist_path} está en el formato anterior (index.pkl con pickle). Migrarlo con "
+            f"app.docstore.convert_legacy('{persist_path}') o cargarlo con ALLOW_PICKLE_INDEX=1"
+        )
+    # Índice y docstore de la generación que nombra este format.json (ver app/docstore.py)
+    index = read_index(persist_path, mmap=mmap, fmt=fmt)
+    manifest = load_manifest(persist_path)
+    if manifest and manifest.get("index_spec"):
+        apply_search_params(index, manifest["index_spec"])
+    if fmt:
+        docstore, index_to_docstore_id = open_docstore(persist_path, fmt) if mmap else load_docstore(persist_path, fmt)
+    else:
+        # Formato anterior: pickle solo con opt-in explícito (ejecuta código al deserializar)
+        print(f"⚠️ Cargando {persist_path}/{LEGACY_FILE} con pickle (ALLOW_PICKLE_INDEX=1); migrarlo con convert_legacy")
+        with open(os.path.join(persist_path, LEGACY_FILE), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+    vectordb = FAISS(embeddings, index, docstore, index_to_docstore_id)
+    bm25 = BM25Index.load(persist_path)
+    if bm25 is not None:
+        _bm25_indexes[vectordb] = bm25
+    return vectordb
+
+def get_bm25(vectordb):
+    # Índices sin bm25.json (anteriores a la recuperación híbrida) se indexan en memoria
+    if vectordb not in _bm25_indexes:
+        _bm25_indexes[vectordb] = BM25Index.from_vectorstore(vectordb)
+    return _bm25_indexes[vectordb]
+
+def make_retriever(vectordb, mode=RETRIEVER_MODE, k=RETRIEVER_K, max_tokens=CONTEXT_MAX_TOKENS, rerank=RERANK):
+    if mode not in ("hybrid", "vector", "bm25"):
+        raise ValueError(f"RETRIEVER_MODE desconocido: {mode}")
+    if rerank != "off" and rerank not in SCORERS:
+        raise ValueError(f"RERANK desconocido: {rerank}")
+    bm25 = get_bm25(vectordb) if mode != "vector" else None
+    if rerank == "off":
+        retriever = HybridRetriever(vectorstore=vectordb, bm25=bm25, k=k, mode=mode)
+    else:
+        # Más candidatos de la recuperación; el rerank deja pasar solo los k mejores
+        fetch_k = max(k, RERANK_FETCH_K)
+        base = HybridRetriever(vectorstore=vectordb, bm25=bm25, k=fetch_k, fetch_k=max(20, fetch_k), mode=mode)
+        retriever = RerankRetriever(base=base, scorer=rerank, top_n=k, model=RERANK_MODEL)
+    if not max_tokens:
+        return retriever
+    # Contexto sin solapamientos ni casi-duplicados y dentro del presupuesto de tokens
+    return BudgetedRetriever(
+        base=retriever, max_tokens=max_tokens, dedup_threshold=CONTEXT_DEDUP_THRESHOLD, count_tokens=count_tokens
     )
-    chunks = splitter.split_documents(docs)
-    embeddings = OpenAIEmbeddings()
-    return FAISS.from_documents(chunks, embedding=embeddings)
 
-def load_vectorstore_from_disk(persist_path=VECTOR_DIR):
-    embeddings = OpenAIEmbeddings()
-    return FAISS.load_local(persist_path, embeddings, allow_dangerous_deserialization=True)
+_prompts = {}
 
 def load_prompt(version="v1_asistente_cientifico"):
     prompt_path = os.path.join(PROMPT_DIR, f"{version}.txt")
     if not os.path.exists(prompt_path):
         raise FileNotFoundError(f"Prompt no encontrado: {prompt_path}")
-    with open(prompt_path, "r") as f:
-        prompt_text = f.read()
-    return PromptTemplate(input_variables=["context", "question"], template=prompt_text)
+    cache_key = (prompt_path, os.stat(prompt_path).st_mtime_ns)
+    if cache_key not in _prompts:
+        from langchain_core.prompts import PromptTemplate
+        with open(prompt_path, "r") as f:
+            prompt_text = f.read()
+        _prompts[cache_key] = PromptTemplate(input_variables=["context", "question"], template=prompt_text)
+    return _prompts[cache_key]
+
+# --- Recursos compartidos por proceso (índice, LLMs y cadenas) ---
+# Streamlit re-ejecuta los scripts en cada interacción pero los módulos importados
+# viven todo el proceso, así que estos cachés se comparten entre sesiones.
+
+_resources_lock = threading.RLock()
+_llms = {}
+_vectorstores = {}
+_chains = {}
+
+def get_llm(model="gpt-4o", temperature=0):
+    with _resources_lock:
+        if (model, temperature) not in _llms:
+            from langchain_openai import ChatOpenAI
+            _llms[(model, temperature)] = ChatOpenAI(model=model, temperature=temperature)
+        return _llms[(model, temperature)]
+
+def _index_signature(persist_path):
+    # mtimes de format.json (cambia cuando save_vectorstore publica una generación nueva), del
+    # manifest y del index.pkl de los índices anteriores
+    signature = []
+    for name in ("format.json", "index.pkl", MANIFEST_FILE):
+        path = os.path.join(persist_path, name)
+        signature.append(os.stat(path).st_mtime_ns if os.path.exists(path) else None)
+    return tuple(signature)
+
+def _reload_vectorstore(persist_path, signature):
+    # format.json se reemplaza de forma atómica después de escribir la generación, así que se
+    # puede recargar de inmediato; mientras tanto se sigue sirviendo la anterior
+    try:
+        vectordb = load_vectorstore_from_disk(persist_path, mmap=True)
+        with _resources_lock:
+            _vectorstores[persist_path] = {"db": vectordb, "signature": signature, "reloading": False}
+        print(f"🔄 Índice recargado desde {persist_path}")
+    except Exception as e:
+        print(f"⚠️ No se pudo recargar el índice {persist_path}: {e}")
+        with _resources_lock:
+            _vectorstores[persist_path]["reloading"] = False
+
+def get_vectorstore(persist_path=VECTOR_DIR):
+    # Carga el índice una vez por proceso. Si cambia en disco, se recarga en segundo plano
+    # y mientras tanto se sigue sirviendo la versión anterior (hot-swap).
+    signature = _index_signature(persist_path)
+    with _resources_lock:
+        entry = _vectorstores.get(persist_path)
+        if entry is None:
+            entry = {"db": load_vectorstore_from_disk(persist_path, mmap=True), "signature": signature, "reloading": False}
+            _vectorstores[persist_path] = entry
+        elif entry["signature"] != signature and not entry["reloading"]:
+            entry["reloading"] = True
+            threading.Thread(target=_reload_vectorstore, args=(persist_path, signature), daemon=True).start()
+        return entry["db"]
+
+def get_chain(prompt_version="v1_asistente_cientifico", persist_path=VECTOR_DIR):
+    vectordb = get_vectorstore(persist_path)
+    with _resources_lock:
+        entry = _chains.get((prompt_version, persist_path))
+        if entry is None or entry["db"] is not vectordb:
+            entry = {"db": vectordb, "chain": build_chain(vectordb, prompt_version)}
+            _chains[(prompt_version, persist_path)] = entry
+        return entry["chain"]
+
+def warm_up(prompt_version="v1_asistente_cientifico", persist_path=VECTOR_DIR):
+    # Carga en segundo plano índice, prompt, cadena y encoding de tokens para que la UI se
+    # muestre de inmediato; la primera pregunta espera el mismo lock en vez de cargar de nuevo
+    def _load():
+        try:
+            get_chain(prompt_version, persist_path)
+            count_tokens("")
+        except Exception as e:
+            print(f"⚠️ Precarga fallida, se cargará en la primera pregunta: {e}")
+
+    thread = threading.Thread(target=_load, daemon=True)
+    thread.start()
+    return thread
+
+def build_chain(vectordb, prompt_version="v1_asistente_cientifico", llm=None):
+    from langchain.chains import ConversationalRetrievalChain
 
-def build_chain(vectordb, prompt_version="v1_asistente_cientifico"):
     prompt = load_prompt(prompt_version)
-    retriever = vectordb.as_retriever()
+    retriever = make_retriever(vectordb)
     return ConversationalRetrievalChain.from_llm(
-        llm = ChatOpenAI(model="gpt-4o", temperature=0),
+        llm = llm or get_llm("gpt-4o", temperature=0),
         retriever=retriever,
         combine_docs_chain_kwargs={"prompt": prompt},
         return_source_documents=False
     )
+
+# --- Respuestas en streaming ---
+# Mismo flujo que ConversationalRetrievalChain (condensar pregunta -> recuperar -> prompt),
+# pero la generación final se hace con llm.stream para entregar tokens a medida que llegan.
+
+def _stream_inputs(chain, question, chat_history):
+    from langchain.chains.conversational_retrieval.base import _get_chat_history
+    chat_history_str = (chain.get_chat_history or _get_chat_history)(list(chat_history))
+    return question, chat_history_str
+
+def _combine_prompt(chain, docs, question, chat_history_str):
+    from langchain_core.prompts import format_document
+    combine = chain.combine_docs_chain
+    context = combine.document_separator.join(format_document(doc, combine.document_prompt) for doc in docs)
+    inputs = {"question": question, "chat_history": chat_history_str, combine.document_variable_name: context}
+    prompt = combine.llm_chain.prompt
+    return prompt.format_prompt(**{k: v for k, v in inputs.items() if k in prompt.input_variables})
+
+def _token_text(chunk):
+    return chunk.content if hasattr(chunk, "content") else str(chunk)
+
+def _generation_stats(timings, docs, prompt_value, tokens, generation_start):
+    timings["generate_s"] = time.perf_counter() - generation_start
+    timings["n_docs"] = len(docs)
+    timings["n_chunks"] = len(tokens)
+    # En streaming la API no devuelve el uso de tokens: se cuentan localmente, con los mismos
+    # nombres que TraceCallbackHandler en las evaluaciones
+    timings["generate_prompt_tokens"] = count_tokens(prompt_value.to_string())
+    timings["generate_completion_tokens"] = count_tokens("".join(tokens))
+
+def stream_answer(chain, question, chat_history=(), timings=None):
+    # Generador de tokens de la respuesta. Si se pasa `timings` (dict) se completa con
+    # ttft_s (tiempo al primer token), total_s, el tiempo de cada etapa (condense_s,
+    # retrieval_s con embed_s/bm25_search_s/faiss_search_s, generate_s), n_docs y tokens
+    # (generate_prompt_tokens, generate_completion_tokens).
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    trace = Trace()
+    with activate(trace):
+        question, chat_history_str = _stream_inputs(chain, question, chat_history)
+        if chat_history_str:
+            with stage("condense"):
+                question = chain.question_generator.invoke({"question": question, "chat_history": chat_history_str})["text"]
+        with stage("retrieval"):
+            docs = chain.retriever.invoke(question)
+    timings.update(trace.as_metrics())
+    prompt_value = _combine_prompt(chain, docs, question, chat_history_str)
+
+    generation_start = time.perf_counter()
+    tokens = []
+    for chunk in chain.combine_docs_chain.llm_chain.llm.stream(prompt_value):
+        if not tokens:
+            timings["ttft_s"] = time.perf_counter() - start
+        tokens.append(_token_text(chunk))
+        yield tokens[-1]
+    _generation_stats(timings, docs, prompt_value, tokens, generation_start)
+    timings["total_s"] = time.perf_counter() - start
+
+async def astream_answer(chain, question, chat_history=(), timings=None):
+    # Versión asíncrona de stream_answer, con las mismas etapas en `timings`
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    trace = Trace()
+    with activate(trace):
+        question, chat_history_str = _stream_inputs(chain, question, chat_history)
+        if chat_history_str:
+            with stage("condense"):
+                result = await chain.question_generator.ainvoke({"question": question, "chat_history": chat_history_str})
+                question = result["text"]
+        with stage("retrieval"):
+            # El retriever corre en run_in_executor, que copia el contexto con la traza activa
+            docs = await chain.retriever.ainvoke(question)
+    timings.update(trace.as_metrics())
+    prompt_value = _combine_prompt(chain, docs, question, chat_history_str)
+
+    generation_start = time.perf_counter()
+    tokens = []
+    async for chunk in chain.combine_docs_chain.llm_chain.llm.astream(prompt_value):
+        if not tokens:
+            timings["ttft_s"] = time.perf_counter() - start
+        tokens.append(_token_text(chunk))
+        yield tokens[-1]
+    _generation_stats(timings, docs, prompt_value, tokens, generation_start)
+    timings["total_s"] = time.perf_counter() - start
+
+# --- Historial de conversación acotado ---
+# ConversationalRetrievalChain hace una llamada extra al LLM para reescribir la pregunta
+# cuando hay historial. Si la pregunta ya es autocontenida se envía sin historial (sin
+# condensar), y si no, solo con los últimos turnos que caben en el presupuesto.
+
+_FOLLOW_UP_WORDS = {
+    "it", "its", "they", "them", "their", "this", "that", "these", "those", "he", "she",
+    "there", "former", "latter", "above", "previous", "same", "also", "else", "more",
+    "eso", "esto", "esa", "ese", "esta", "este", "estos", "estas", "esos", "esas",
+    "ella", "ellos", "ellas", "su", "sus", "también", "anterior", "mismo", "misma", "más",
+}
+_FOLLOW_UP_PREFIXES = ("and ", "what about", "how about", "y ", "¿y ", "why", "por qué", "¿por qué")
+
+def is_standalone(question):
+    # Heurística barata: sin pronombres/referencias a turnos previos y con al menos 4 palabras
+    text = question.strip().lower()
+    words = [w.strip("¿?¡!.,;:()\"'") for w in text.split()]
+    if len(words) < 4 or text.startswith(_FOLLOW_UP_PREFIXES):
+        return False
+    return not any(w in _FOLLOW_UP_WORDS for w in words)
+
+def trim_history(chat_history, max_turns=HISTORY_MAX_TURNS, max_tokens=HISTORY_MAX_TOKENS):
+    # Últimos turnos (pregunta, respuesta) que caben en max_turns y max_tokens
+    kept, tokens = [], 0
+    for question, answer in reversed(list(chat_history)[-max_turns:] if max_turns else []):
+        tokens += count_tokens(question) + count_tokens(answer)
+        if kept and tokens > max_tokens:
+            break
+        kept.append((question, answer))
+    return list(reversed(kept))
+
+def summarize_history(summary_state, dropped_turns, llm=None):
+    # Resumen incremental de los turnos que ya no entran en el historial.
+    # summary_state es un dict del llamador (p. ej. en st.session_state) con "text" y "n_turns".
+    new_turns = dropped_turns[summary_state.get("n_turns", 0):]
+    if new_turns:
+        llm = llm or get_llm(SUMMARY_MODEL, temperature=0)
+        turns = "\n".join(f"Human: {q}\nAssistant: {a}" for q, a in new_turns)
+        prompt = (
+            "Update the running summary of this conversation in at most 5 sentences, "
+            "keeping entities, product names and numbers.\n\n"
+            f"Current summary:\n{summary_state.get('text', '')}\n\nNew turns:\n{turns}\n\nUpdated summary:"
+        )
+        summary_state["text"] = llm.invoke(prompt).content
+        summary_state["n_turns"] = len(dropped_turns)
+    return summary_state.get("text", "")
+
+def prepare_chat_history(question, chat_history, summary_state=None, llm=None):
+    chat_history = list(chat_history)
+    if not chat_history or is_standalone(question):
+        return []
+    recent = trim_history(chat_history)
+    if HISTORY_SUMMARY and summary_state is not None:
+        summary = summarize_history(summary_state, chat_history[:len(chat_history) - len(recent)], llm)
+        if summary:
+            recent = [("Summary of the earlier conversation", summary)] + recent
+    return recent
+
+# Trazas (etapas, tokens) de las respuestas de las UIs, para el panel de latencias
+trace_sink = LocalTraceSink()
+
+# --- Caché semántica de respuestas ---
+
+_semantic_cache = None
+
+def get_semantic_cache():
+    global _semantic_cache
+    with _resources_lock:
+        if _semantic_cache is None:
+            from app.semantic_cache import SemanticCache
+            _semantic_cache = SemanticCache(
+                get_embeddings(),
+                threshold=SEMANTIC_CACHE_THRESHOLD,
+                ttl_s=SEMANTIC_CACHE_TTL_S,
+                max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+            )
+        return _semantic_cache
+
+_fingerprints = {}
+
+def corpus_fingerprint(persist_path=VECTOR_DIR):
+    # Hash del corpus indexado (del manifest); para índices sin manifest, hash del índice.
+    # Se llama en cada pregunta: memoizado por los mtimes del manifest y de format.json, así
+    # solo se vuelve a leer el manifest (que lista todos los chunks) cuando cambia el índice
+    signature = _index_signature(persist_path)
+    cached = _fingerprints.get(persist_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    manifest = load_manifest(persist_path)
+    if manifest and "corpus_sha256" in manifest:
+        fingerprint = manifest["corpus_sha256"]
+    else:
+        from app.docstore import vectors_path
+        fingerprint = file_sha256(vectors_path(persist_path))
+    _fingerprints[persist_path] = (signature, fingerprint)
+    return fingerprint
+
+# Generaciones de las UIs: preguntas idénticas en curso comparten una llamada al LLM, con
+# concurrencia global acotada y límite por sesión (ver app/request_coordinator.py)
+coordinator = RequestCoordinator(CHAT_MAX_CONCURRENCY, CHAT_SESSION_RPM, CHAT_SESSION_BURST, CHAT_QUEUE_TIMEOUT_S)
+
+def answer_stream(question, chat_history=(), timings=None, prompt_version="v1_asistente_cientifico", persist_path=VECTOR_DIR,
+                  session_id=None):
+    # stream_answer sobre la cadena compartida, con caché semántica para preguntas sin historial
+    # (las preguntas con historial dependen de la conversación y no se cachean)
+    timings = {} if timings is None else timings
+    chain = get_chain(prompt_version, persist_path)
+    chat_history = [tuple(turn) for turn in chat_history]
+    key = (prompt_version, persist_path, question.strip(), tuple(chat_history))
+    start = time.perf_counter()
+    cache = answer = None
+    # Las consultas solo de identificadores ("IW GRD") se recuperan con BM25 sin embeddings:
+    # la caché semántica las embebería igual, así que no pasan por ella
+    if SEMANTIC_CACHE and not chat_history and not is_keyword_query(question):
+        cache = get_semantic_cache()
+        namespace = (prompt_version, corpus_fingerprint(persist_path))
+        answer = cache.lookup(namespace, question)
+        timings["cache_hit"] = answer is not None
+
+    def generate(generation_timings):
+        # Corre una vez por clave aunque la pidan varias sesiones; guarda la respuesta en caché
+        tokens = []
+        for token in stream_answer(chain, question, chat_history, generation_timings):
+            tokens.append(token)
+            yield token
+        if cache is not None:
+            cache.store(namespace, question, "".join(tokens))
+
+    if answer is not None:
+        timings["ttft_s"] = timings["total_s"] = time.perf_counter() - start
+        timings["n_chunks"] = 1
+        yield answer
+    else:
+        yield from coordinator.stream(session_id, key, generate, timings)
+    trace_sink.write(timings)
+
+    if cache is not None:
+        lookups = cache.hits + cache.misses
+        if SEMANTIC_CACHE_LOG_EVERY and lookups % SEMANTIC_CACHE_LOG_EVERY == 0:
+            threading.Thread(target=cache.log_to_mlflow, daemon=True).start()
+
+# Compatibilidad: la ingesta se movió a app/ingest.py y solo se importa si se usa
+_INGEST_NAMES = {
+    "iter_pdf_pages", "iter_documents", "load_documents", "chunk_ids", "write_manifest", "build_faiss_index",
+    "reindex_vectorstore", "save_vectorstore", "INGEST_WORKERS", "INGEST_PAGES_PER_TASK", "EMBED_BATCH_SIZE",
+    "INDEX_TRAIN_SIZE",
+}
+
+def __getattr__(name):
+    if name in _INGEST_NAMES:
+        from app import ingest
+        return getattr(ingest, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
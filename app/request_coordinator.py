@@ -0,0 +1,243 @@
+# app/request_coordinator.py
+# Coordinador de respuestas en proceso para las UIs de Streamlit (todas las sesiones comparten
+# el proceso):
+#   - single-flight: preguntas idénticas en curso (misma clave) comparten una sola llamada al
+#     LLM; quien llega después recibe los tokens ya generados y luego los nuevos
+#   - concurrencia global: como máximo max_concurrency generaciones a la vez
+#   - token bucket por sesión (rpm, burst): una sesión que pregunta de más espera su turno
+#     en lugar de consumir la cuota de OpenAI de las demás. Un bucket lleno equivale a uno
+#     nuevo, así que los de sesiones sin nada en cola se descartan al recargarse
+#   - cola justa: las generaciones en espera se despachan round-robin entre sesiones
+# La generación corre en un hilo propio, así sigue aunque la sesión que la pidió se vaya (las
+# demás la siguen leyendo). Con queue_timeout_s una petición que sigue en cola pasado ese tiempo
+# se retira con TimeoutError; si nadie más esperaba esa generación, sale de la cola sin llamar
+# al LLM. stats() expone profundidad de cola y tiempos de espera.
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+class TokenBucket:
+
+    def __init__(self, rpm, burst):
+        self.rate = rpm / 60.0
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def wait_time(self, now):
+        # Segundos hasta tener un token (0 si ya hay)
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(now, self.updated)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Flight:
+    # Una generación: tokens producidos hasta ahora y timings de stream_answer
+
+    def __init__(self, key, session_id, produce, lock):
+        self.key = key
+        self.session_id = session_id
+        self.produce = produce
+        self.cond = threading.Condition(lock)
+        self.tokens = []
+        self.timings = {}
+        self.error = None
+        self.done = False
+        self.enqueued = time.monotonic()
+        self.started = None
+        self.rate_limited = False
+        self.subscribers = 1
+
+
+class RequestCoordinator:
+
+    def __init__(self, max_concurrency=8, session_rpm=10, session_burst=3, queue_timeout_s=0):
+        self.max_concurrency = max_concurrency
+        self.session_rpm = session_rpm  # 0 desactiva el límite por sesión
+        self.session_burst = session_burst
+        self.queue_timeout_s = queue_timeout_s  # 0 espera sin límite
+        self.requests = 0
+        self.timed_out = 0
+        self.coalesced = 0
+        self.upstream = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self._flights = {}           # clave -> generación en cola o en curso
+        self._queues = OrderedDict()  # sesión -> generaciones en espera; el orden es el turno
+        self._buckets = {}
+        self._next_sweep = 0.0
+        self._running = 0
+        self._retry_at = None        # próxima recarga de un bucket que tiene la cola frenada
+        self._queue_waits = deque(maxlen=1000)
+
+    def _bucket_wait(self, session_id, now):
+        if not self.session_rpm or session_id is None:
+            return 0.0
+        if session_id not in self._buckets:
+            self._buckets[session_id] = TokenBucket(self.session_rpm, self.session_burst)
+        return self._buckets[session_id].wait_time(now)
+
+    def _evict_buckets(self, now):
+        # Con self._lock tomado: como mucho una pasada por tiempo de recarga completa de un bucket
+        if not self.session_rpm or now < self._next_sweep:
+            return
+        self._next_sweep = now + self.session_burst * 60.0 / self.session_rpm
+        for session_id, bucket in list(self._buckets.items()):
+            if session_id not in self._queues and not bucket.wait_time(now) and bucket.tokens >= bucket.burst:
+                del self._buckets[session_id]
+
+    def _dispatch(self):
+        # Con self._lock tomado: arranca generaciones mientras haya cupo, una por sesión por
+        # turno, saltando las sesiones sin tokens en su bucket
+        self._retry_at = None
+        while self._running < self.max_concurrency and self._queues:
+            now = time.monotonic()
+            blocked = {}
+            for session_id in self._queues:
+                wait = self._bucket_wait(session_id, now)
+                if not wait:
+                    break
+                blocked[session_id] = wait
+                head = self._queues[session_id][0]
+                if not head.rate_limited:
+                    head.rate_limited = True
+                    self.rate_limited += 1
+            else:
+                # Todas las sesiones en espera están limitadas: se despiertan al recargar
+                self._retry_at = now + min(blocked.values())
+                for session_id in blocked:
+                    self._queues[session_id][0].cond.notify_all()
+                return
+            queue = self._queues.pop(session_id)
+            flight = queue.popleft()
+            if queue:
+                self._queues[session_id] = queue  # al final de la ronda
+            if session_id in self._buckets:
+                self._buckets[session_id].take()
+            self._start(flight, now)
+
+    def _start(self, flight, now):
+        flight.started = now
+        self._running += 1
+        self.upstream += 1
+        self._queue_waits.append(now - flight.enqueued)
+        threading.Thread(target=self._run, args=(flight,), daemon=True).start()
+
+    def _run(self, flight):
+        error = None
+        try:
+            for token in flight.produce(flight.timings):
+                with self._lock:
+                    flight.tokens.append(token)
+                    flight.cond.notify_all()
+        except Exception as e:
+            error = e
+        with self._lock:
+            flight.error = error
+            flight.done = True
+            self._running -= 1
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            flight.cond.notify_all()
+            self._dispatch()
+
+    def _leave(self, flight):
+        # Con self._lock tomado: una sesión deja de leer; si nadie espera una generación que
+        # aún no arrancó, se saca de la cola
+        flight.subscribers -= 1
+        if flight.subscribers or flight.started is not None:
+            return
+        queue = self._queues.get(flight.session_id)
+        if queue is not None and flight in queue:
+            queue.remove(flight)
+            if not queue:
+                del self._queues[flight.session_id]
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def stream(self, session_id, key, produce, timings=None):
+        # Generador de tokens. produce(timings) es el generador que llama al LLM; solo se
+        # ejecuta si no hay otra generación en curso con la misma clave. `timings` recibe los
+        # de la generación más queue_s, queue_depth y coalesced, con ttft_s y total_s medidos
+        # desde la llegada de esta petición.
+        timings = {} if timings is None else timings
+        start, arrival = time.perf_counter(), time.monotonic()
+        with self._lock:
+            self.requests += 1
+            timings["queue_depth"] = sum(len(q) for q in self._queues.values())
+            self._evict_buckets(arrival)
+            flight = self._flights.get(key)
+            timings["coalesced"] = flight is not None
+            if flight is None:
+                flight = self._flights[key] = _Flight(key, session_id, produce, self._lock)
+                self._queues.setdefault(session_id, deque()).append(flight)
+                self._dispatch()
+            else:
+                flight.subscribers += 1
+                self.coalesced += 1
+
+        sent, first_token, finished = 0, None, False
+        deadline = arrival + self.queue_timeout_s if self.queue_timeout_s else None
+        try:
+            while True:
+                with self._lock:
+                    while sent == len(flight.tokens) and not flight.done:
+                        timeout = None
+                        if flight.started is None:
+                            self._dispatch()
+                            if flight.started is not None:
+                                continue
+                            if self._retry_at is not None:
+                                timeout = max(self._retry_at - time.monotonic(), 0.001)
+                            if deadline is not None:
+                                remaining = deadline - time.monotonic()
+                                if remaining <= 0:
+                                    self.timed_out += 1
+                                    raise TimeoutError(f"Sin turno tras {self.queue_timeout_s:.0f}s en cola")
+                                timeout = remaining if timeout is None else min(timeout, remaining)
+                        flight.cond.wait(timeout)
+                    if "queue_s" not in timings and flight.started is not None:
+                        timings["queue_s"] = max(0.0, flight.started - arrival)
+                    tokens = flight.tokens[sent:]
+                    finished = flight.done and sent + len(tokens) == len(flight.tokens)
+                for token in tokens:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    yield token
+                sent += len(tokens)
+                if finished:
+                    break
+        finally:
+            if not finished:
+                with self._lock:
+                    self._leave(flight)
+
+        if flight.error is not None:
+            raise flight.error
+        timings.update({k: v for k, v in flight.timings.items() if k not in ("ttft_s", "total_s")})
+        timings["ttft_s"] = first_token if first_token is not None else time.perf_counter() - start
+        timings["total_s"] = time.perf_counter() - start
+
+    def stats(self):
+        with self._lock:
+            waits = list(self._queue_waits)
+            return {
+                "running": self._running,
+                "queue_depth": sum(len(q) for q in self._queues.values()),
+                "sessions_waiting": len(self._queues),
+                "sessions_tracked": len(self._buckets),
+                "requests": self.requests,
+                "coalesced": self.coalesced,
+                "upstream": self.upstream,
+                "rate_limited": self.rate_limited,
+                "timed_out": self.timed_out,
+                "queue_wait_p50_s": float(np.percentile(waits, 50)) if waits else 0.0,
+                "queue_wait_p95_s": float(np.percentile(waits, 95)) if waits else 0.0,
+            }
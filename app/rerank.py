@@ -0,0 +1,97 @@
+# app/rerank.py
+# Reranking local entre la recuperación y el armado del contexto: se traen más candidatos de
+# los que van al prompt (RERANK_FETCH_K) y se reordenan en CPU para pasar solo los mejores
+# (RETRIEVER_K). Scorers:
+#   lexical        BM25 sobre los candidatos, combinado con la posición que traían
+#   mmr            misma relevancia + diversidad (maximal marginal relevance, Jaccard de términos)
+#   cross_encoder  cross-encoder local de sentence-transformers (RERANK_MODEL); si no está
+#                  instalado o el modelo no carga se usa lexical
+
+from typing import Any
+
+from langchain_core.retrievers import BaseRetriever
+
+from app.hybrid_retriever import BM25Index, tokenize
+from app.tracing import stage
+
+SCORERS = ("lexical", "mmr", "cross_encoder")
+
+_cross_encoders = {}
+
+
+def relevance(query, docs):
+    # BM25 normalizado (0..1) + prior por posición (1/(rank+1)), promediados: los candidatos
+    # sin términos en común con la consulta conservan el orden de la recuperación
+    bm25 = BM25Index.from_texts(range(len(docs)), [d.page_content for d in docs])
+    scores = [0.0] * len(docs)
+    for i, score in bm25.search(query, k=len(docs)):
+        scores[i] = score
+    top = max(scores) or 1.0
+    return [(scores[i] / top + 1.0 / (i + 1)) / 2 for i in range(len(docs))]
+
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def mmr(query, docs, top_n, lambda_mult=0.7):
+    rel = relevance(query, docs)
+    terms = [set(tokenize(d.page_content)) for d in docs]
+    selected, candidates = [], list(range(len(docs)))
+    while candidates and len(selected) < top_n:
+        best = max(candidates, key=lambda i: lambda_mult * rel[i] - (1 - lambda_mult) * max(
+            (_jaccard(terms[i], terms[j]) for j in selected), default=0.0))
+        selected.append(best)
+        candidates.remove(best)
+    return [docs[i] for i in selected]
+
+
+def _cross_encoder(model):
+    if model not in _cross_encoders:
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError:
+            print("⚠️ sentence-transformers no está instalado; se usa el rerank lexical")
+            _cross_encoders[model] = None
+        else:
+            # Modelo inexistente, sin red para descargarlo, pesos corruptos...: se avisa una vez
+            # y se recuerda el fallo para no reintentar la carga en cada pregunta
+            try:
+                _cross_encoders[model] = CrossEncoder(model)
+            except Exception as e:
+                print(f"⚠️ No se pudo cargar el cross-encoder {model!r} ({e}); se usa el rerank lexical")
+                _cross_encoders[model] = None
+    return _cross_encoders[model]
+
+
+def rerank(query, docs, scorer="lexical", top_n=4, model=None, lambda_mult=0.7):
+    if len(docs) <= 1:
+        return docs[:top_n]
+    if scorer == "mmr":
+        return mmr(query, docs, top_n, lambda_mult)
+    encoder = _cross_encoder(model) if scorer == "cross_encoder" else None
+    if encoder is not None:
+        scores = list(encoder.predict([(query, d.page_content) for d in docs]))
+    else:
+        scores = relevance(query, docs)
+    order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+    return [docs[i] for i in order[:top_n]]
+
+
+class RerankRetriever(BaseRetriever):
+    base: BaseRetriever
+    scorer: str = "lexical"
+    top_n: int = 4
+    model: Any = None
+    lambda_mult: float = 0.7
+
+    def _rerank(self, query, docs):
+        with stage("rerank"):
+            return rerank(query, docs, self.scorer, self.top_n, self.model, self.lambda_mult)
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        docs = self.base.invoke(query, config={"callbacks": run_manager.get_child() if run_manager else None})
+        return self._rerank(query, docs)
+
+    def retrieve_batch(self, queries):
+        return [self._rerank(query, docs) for query, docs in zip(queries, self.base.retrieve_batch(queries))]
@@ -0,0 +1,162 @@
+# app/results_store.py
+# Snapshot local (SQLite) de los runs de todos los experimentos "eval_*".
+# Cada sincronización solo trae los runs nuevos desde la última, y para el store
+# de archivos (mlruns/) se omite por completo un experimento si su directorio no cambió.
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import mlflow
+import pandas as pd
+from mlflow.tracking import MlflowClient
+from mlflow.utils.file_utils import local_file_uri_to_path
+
+from app.results_writer import is_summary_run
+
+RESULTS_STORE_PATH = os.getenv("RESULTS_STORE_PATH", ".cache/eval_results.sqlite")
+
+_lock = threading.Lock()
+
+
+@contextmanager
+def _connect(path=RESULTS_STORE_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id TEXT PRIMARY KEY, experiment_id TEXT, experiment TEXT, start_time INTEGER,
+            question TEXT, prompt_version TEXT, chunk_size INTEGER, chunk_overlap INTEGER,
+            k INTEGER, model TEXT
+        );
+        CREATE TABLE IF NOT EXISTS metrics (
+            run_id TEXT, key TEXT, value REAL, PRIMARY KEY (run_id, key)
+        );
+        CREATE TABLE IF NOT EXISTS sync_state (
+            experiment_id TEXT PRIMARY KEY, experiment TEXT, fingerprint TEXT, watermark INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_runs_experiment ON runs(experiment);
+        """
+    )
+    _migrate(conn)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _migrate(conn):
+    # Snapshots anteriores sin las columnas del barrido (k, model): se agregan y se borra el
+    # estado de sincronización para que la próxima sync vuelva a leer todos los runs
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(runs)")}
+    if "k" not in columns:
+        with conn:
+            conn.execute("ALTER TABLE runs ADD COLUMN k INTEGER")
+            conn.execute("ALTER TABLE runs ADD COLUMN model TEXT")
+            conn.execute("DELETE FROM sync_state")
+
+
+def _experiment_fingerprint(experiment):
+    # Para el store de archivos basta con el mtime y el número de entradas del directorio
+    # del experimento: cambia cada vez que se crea un run nuevo
+    uri = mlflow.get_tracking_uri()
+    if "://" in uri and not uri.startswith("file:"):
+        return None
+    exp_dir = os.path.join(local_file_uri_to_path(uri), experiment.experiment_id)
+    if not os.path.isdir(exp_dir):
+        return None
+    stat = os.stat(exp_dir)
+    return f"{stat.st_mtime_ns}:{len(os.listdir(exp_dir))}"
+
+
+def _search_new_runs(client, experiment_id, watermark):
+    filter_string = f"attributes.start_time > {watermark}" if watermark else ""
+    runs, token = [], None
+    while True:
+        page = client.search_runs(
+            experiment_ids=[experiment_id], filter_string=filter_string, max_results=1000, page_token=token
+        )
+        runs.extend(page)
+        token = page.token
+        if not token:
+            return runs
+
+
+def sync(path=RESULTS_STORE_PATH):
+    client = MlflowClient()
+    with _lock, _connect(path) as conn:
+        state = {
+            row[0]: (row[1], row[2])
+            for row in conn.execute("SELECT experiment_id, fingerprint, watermark FROM sync_state")
+        }
+        for experiment in client.search_experiments():
+            if not experiment.name.startswith("eval_"):
+                continue
+            fingerprint = _experiment_fingerprint(experiment)
+            old_fingerprint, watermark = state.get(experiment.experiment_id, (None, 0))
+            if fingerprint is not None and fingerprint == old_fingerprint:
+                continue
+
+            runs = _search_new_runs(client, experiment.experiment_id, watermark)
+            unfinished = [r.info.start_time for r in runs if r.info.status == "RUNNING"]
+            for run in runs:
+                if is_summary_run(run):
+                    continue
+                params = run.data.params
+                # k y model solo existen en los runs de run_sweep
+                k = params.get("k")
+                conn.execute(
+                    "INSERT OR REPLACE INTO runs (run_id, experiment_id, experiment, start_time, question, "
+                    "prompt_version, chunk_size, chunk_overlap, k, model) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        run.info.run_id, experiment.experiment_id, experiment.name, run.info.start_time,
+                        params.get("question"), params.get("prompt_version"),
+                        int(params.get("chunk_size", 0)), int(params.get("chunk_overlap", 0)),
+                        int(k) if k is not None else None, params.get("model"),
+                    ),
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO metrics VALUES (?, ?, ?)",
+                    [(run.info.run_id, key, value) for key, value in run.data.metrics.items()],
+                )
+
+            # Los runs que siguen en curso se vuelven a leer en la próxima sincronización
+            if unfinished:
+                watermark, fingerprint = min(unfinished) - 1, None
+            elif runs:
+                watermark = max(watermark, max(r.info.start_time for r in runs))
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?)",
+                (experiment.experiment_id, experiment.name, fingerprint, watermark),
+            )
+
+
+def list_experiments(path=RESULTS_STORE_PATH):
+    with _connect(path) as conn:
+        return [row[0] for row in conn.execute("SELECT experiment FROM sync_state ORDER BY experiment")]
+
+
+def load_results(experiments=None, path=RESULTS_STORE_PATH):
+    # Tabla ancha: una fila por run con sus parámetros y una columna por métrica
+    with _connect(path) as conn:
+        where, args = "", []
+        if experiments is not None:
+            where = f"WHERE experiment IN ({','.join('?' * len(experiments))})"
+            args = list(experiments)
+        runs = pd.read_sql_query(f"SELECT * FROM runs {where} ORDER BY start_time DESC", conn, params=args)
+        metrics = pd.read_sql_query(
+            f"SELECT m.run_id, m.key, m.value FROM metrics m JOIN runs r ON r.run_id = m.run_id {where}",
+            conn, params=args,
+        )
+    if not metrics.empty:
+        wide = metrics.pivot(index="run_id", columns="key", values="value").reset_index()
+        runs = runs.merge(wide, on="run_id", how="left")
+    return runs
+
+
+def metric_column(df, name):
+    # Igual que metrics.get(name, 0) sobre los runs de MLflow
+    return df[name].fillna(0) if name in df else pd.Series(0.0, index=df.index)
@@ -0,0 +1,89 @@
+# app/results_writer.py
+# Acumula en memoria los resultados de una evaluación y los escribe a MLflow de una vez:
+# un run padre (resumen + artefacto columnar) con un run hijo por pregunta vía log_batch.
+
+import os
+import tempfile
+import time
+
+import pandas as pd
+from mlflow.entities import Metric, Param, RunTag
+from mlflow.tracking import MlflowClient
+from mlflow.utils.mlflow_tags import MLFLOW_PARENT_RUN_ID
+
+SUMMARY_TAG = "eval_role"
+
+
+def is_summary_run(run):
+    return run.data.tags.get(SUMMARY_TAG) == "summary"
+
+
+class ResultsWriter:
+
+    def __init__(self, experiment_name, run_name="eval", params=None):
+        self.experiment_name = experiment_name
+        self.run_name = run_name
+        self.params = dict(params or {})
+        self.rows = []
+        self.summary_metrics = {}  # métricas solo del run padre (p. ej. percentiles de latencia)
+
+    def add(self, run_name, params, metrics):
+        self.rows.append({"run_name": run_name, "params": dict(params), "metrics": dict(metrics)})
+
+    def to_dataframe(self):
+        return pd.DataFrame(
+            [{"run_name": row["run_name"], **row["params"], **row["metrics"]} for row in self.rows]
+        )
+
+    def _experiment_id(self, client):
+        experiment = client.get_experiment_by_name(self.experiment_name)
+        if experiment is None:
+            return client.create_experiment(self.experiment_name)
+        return experiment.experiment_id
+
+    def _write_artifact(self, client, run_id, df):
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                path = os.path.join(tmp, "results.parquet")
+                df.to_parquet(path, index=False)
+            except ImportError:
+                path = os.path.join(tmp, "results.csv")
+                df.to_csv(path, index=False)
+            client.log_artifact(run_id, path)
+
+    def flush(self):
+        if not self.rows:
+            return None
+        client = MlflowClient()
+        experiment_id = self._experiment_id(client)
+        now = int(time.time() * 1000)
+        df = self.to_dataframe()
+
+        # Run padre: parámetros comunes, promedio de cada métrica y el artefacto con todas las filas
+        parent = client.create_run(experiment_id, run_name=self.run_name, tags={SUMMARY_TAG: "summary"})
+        parent_id = parent.info.run_id
+        metric_names = sorted({name for row in self.rows for name in row["metrics"]})
+        client.log_batch(
+            parent_id,
+            metrics=[Metric(name, float(df[name].mean()), now, 0) for name in metric_names]
+            + [Metric(name, float(value), now, 0) for name, value in self.summary_metrics.items()],
+            params=[Param(k, str(v)) for k, v in self.params.items()],
+        )
+        self._write_artifact(client, parent_id, df)
+
+        # Un run hijo por pregunta, cada uno escrito con una sola llamada a log_batch
+        for row in self.rows:
+            child = client.create_run(
+                experiment_id, run_name=row["run_name"], tags={MLFLOW_PARENT_RUN_ID: parent_id}
+            )
+            client.log_batch(
+                child.info.run_id,
+                metrics=[Metric(k, float(v), now, 0) for k, v in row["metrics"].items()],
+                params=[Param(k, str(v)) for k, v in row["params"].items()],
+                tags=[RunTag(SUMMARY_TAG, "question")],
+            )
+            client.set_terminated(child.info.run_id)
+
+        client.set_terminated(parent_id)
+        print(f"💾 {len(self.rows)} resultados registrados en '{self.experiment_name}' (run {parent_id})")
+        return parent_id
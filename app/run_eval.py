@@ -2,9 +2,12 @@ import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import json
-import mlflow
 from dotenv import load_dotenv
-from app.rag_pipeline import load_vectorstore_from_disk, build_chain
+from app.rag_pipeline import RERANK, load_vectorstore, load_vectorstore_from_disk, build_chain
+from app.eval_engine import call_with_retries, run_concurrent
+from app.context_budget import last_stats
+from app.tracing import percentiles, traced_invoke
+from app.results_writer import ResultsWriter
 
 from langchain_openai import ChatOpenAI
 from langchain.evaluation.qa import QAEvalChain
@@ -15,54 +18,84 @@ load_dotenv()
 PROMPT_VERSION = os.getenv("PROMPT_VERSION", "v1_asistente_cientifico")
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 512))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 50))
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", 4))
+EVAL_FAKE_LLM = os.getenv("EVAL_FAKE_LLM", "0") == "1"
 DATASET_PATH = "tests/eval_dataset.json"
 
 # Cargar dataset
 with open(DATASET_PATH) as f:
     dataset = json.load(f)
 
-# Vectorstore y cadena
-vectordb = load_vectorstore_from_disk()
-chain = build_chain(vectordb, prompt_version=PROMPT_VERSION)
+if EVAL_FAKE_LLM:
+    # Modo offline: LLMs y embeddings locales sobre el índice por defecto (benchmark sin OpenAI)
+    from app.fakes import FakeChatModel, FakeEmbeddings, fake_answer, fake_qa_grade
+    FAKE_LATENCY = float(os.getenv("EVAL_FAKE_LATENCY", 0.5))
+    vectordb = load_vectorstore_from_disk(embeddings=FakeEmbeddings(latency=FAKE_LATENCY / 10))
+    chain = build_chain(vectordb, prompt_version=PROMPT_VERSION, llm=FakeChatModel(responder=fake_answer, latency=FAKE_LATENCY))
+    llm = FakeChatModel(responder=fake_qa_grade, latency=FAKE_LATENCY)
+else:
+    # Vectorstore y cadena (índice del registro para CHUNK_SIZE/CHUNK_OVERLAP)
+    vectordb = load_vectorstore(CHUNK_SIZE, CHUNK_OVERLAP)
+    chain = build_chain(vectordb, prompt_version=PROMPT_VERSION)
+    llm = ChatOpenAI(temperature=0)
 
 # LangChain Evaluator
-llm = ChatOpenAI(temperature=0)
 langchain_eval = QAEvalChain.from_llm(llm)
 
-# ✅ Establecer experimento una vez
-mlflow.set_experiment(f"eval_{PROMPT_VERSION}")
-print(f"📊 Experimento MLflow: eval_{PROMPT_VERSION}")
-
-# Evaluación por lote
-for i, pair in enumerate(dataset):
+# ✅ Experimento y parámetros comunes de esta evaluación
+# Con rerank el experimento lleva sufijo, para comparar (A/B) contra el mismo prompt sin rerank
+RERANK_SUFFIX = f"_rerank_{RERANK}" if RERANK != "off" else ""
+writer = ResultsWriter(
+    f"eval_{PROMPT_VERSION}{RERANK_SUFFIX}",
+    run_name=f"eval_{PROMPT_VERSION}_{CHUNK_SIZE}{RERANK_SUFFIX}",
+    params={"prompt_version": PROMPT_VERSION, "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "rerank": RERANK},
+)
+print(f"📊 Experimento MLflow: eval_{PROMPT_VERSION}{RERANK_SUFFIX}")
+
+def responder(pair):
+    result, traza = call_with_retries(traced_invoke, chain, {"question": pair["question"], "chat_history": []})
+    # Tokens de contexto antes/después del armado (mismo hilo que la recuperación) y
+    # tiempos/tokens por etapa de la traza
+    return result["answer"], {**last_stats(), **traza}
+
+def calificar(item):
+    pair, respuesta_generada = item
+    return call_with_retries(
+        langchain_eval.evaluate_strings,
+        input=pair["question"],
+        prediction=respuesta_generada,
+        reference=pair["answer"]
+    )
+
+# Evaluación concurrente: primero todas las respuestas y luego todas las calificaciones
+respuestas, contextos = zip(*run_concurrent(responder, dataset, max_workers=EVAL_CONCURRENCY))
+writer.summary_metrics.update(percentiles(contextos))
+calificaciones = run_concurrent(calificar, zip(dataset, respuestas), max_workers=EVAL_CONCURRENCY)
+
+# Acumular resultados en el mismo orden del dataset
+for i, (pair, graded, contexto) in enumerate(zip(dataset, calificaciones, contextos)):
     pregunta = pair["question"]
-    respuesta_esperada = pair["answer"]
-
-    with mlflow.start_run(run_name=f"eval_q{i+1}"):
-        result = chain.invoke({"question": pregunta, "chat_history": []})
-        respuesta_generada = result["answer"]
-
-        # Evaluación con LangChain
-        graded = langchain_eval.evaluate_strings(
-            input=pregunta,
-            prediction=respuesta_generada,
-            reference=respuesta_esperada
-        )
-
-        # 🔍 Imprimir el contenido real
-        print(f"\n📦 Resultado evaluación LangChain para pregunta {i+1}/{len(dataset)}:")
-        print(graded)
-
-        lc_verdict = graded.get("value", "UNKNOWN")
-        is_correct = graded.get("score", 0)
-
-        # Log en MLflow
-        mlflow.log_param("question", pregunta)
-        mlflow.log_param("prompt_version", PROMPT_VERSION)
-        mlflow.log_param("chunk_size", CHUNK_SIZE)
-        mlflow.log_param("chunk_overlap", CHUNK_OVERLAP)
-
-        mlflow.log_metric("lc_is_correct", is_correct)
 
-        print(f"✅ Pregunta: {pregunta}")
-        print(f"🧠 LangChain Eval: {lc_verdict}")
+    # 🔍 Imprimir el contenido real
+    print(f"\n📦 Resultado evaluación LangChain para pregunta {i+1}/{len(dataset)}:")
+    print(graded)
+
+    lc_verdict = graded.get("value", "UNKNOWN")
+    is_correct = graded.get("score", 0)
+
+    writer.add(
+        f"eval_q{i+1}",
+        params={
+            "question": pregunta,
+            "prompt_version": PROMPT_VERSION,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+        },
+        metrics={"lc_is_correct": is_correct or 0, **contexto},
+    )
+
+    print(f"✅ Pregunta: {pregunta}")
+    print(f"🧠 LangChain Eval: {lc_verdict}")
+
+# Log en MLflow en bloque (log_batch) + artefacto columnar con todos los resultados
+writer.flush()
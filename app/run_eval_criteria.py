@@ -2,9 +2,14 @@ import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import json
-import mlflow
+import time
 from dotenv import load_dotenv
-from app.rag_pipeline import load_vectorstore_from_disk, build_chain
+from app.rag_pipeline import RERANK, load_vectorstore, load_vectorstore_from_disk, build_chain
+from app.eval_engine import call_with_retries, run_concurrent
+from app.context_budget import last_stats
+from app.tracing import percentiles, traced_invoke
+from app.grader import TokenUsageHandler, grade_batch
+from app.results_writer import ResultsWriter
 
 from langchain_openai import ChatOpenAI
 from langchain.evaluation import load_evaluator
@@ -15,18 +20,35 @@ load_dotenv()
 PROMPT_VERSION = os.getenv("PROMPT_VERSION", "v2_resumido_directo")
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1024))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 100))
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", 4))
+EVAL_FAKE_LLM = os.getenv("EVAL_FAKE_LLM", "0") == "1"
+# batched: una llamada califica los cinco criterios (GRADER_BATCH_SIZE respuestas por llamada)
+# per_criterion: un evaluador "labeled_score_string" por criterio (modo original)
+GRADER_MODE = os.getenv("GRADER_MODE", "batched")
+GRADER_BATCH_SIZE = int(os.getenv("GRADER_BATCH_SIZE", 1))
+# Reintentos en modo batched de las respuestas sin calificación legible; si siguen sin ella se
+# califican con un evaluador por criterio
+GRADER_PARSE_RETRIES = int(os.getenv("GRADER_PARSE_RETRIES", 1))
 DATASET_PATH = "tests/eval_dataset.json"
 
 # Cargar dataset
 with open(DATASET_PATH) as f:
     dataset = json.load(f)
 
-# Vectorstore y cadena
-vectordb = load_vectorstore_from_disk()
-chain = build_chain(vectordb, prompt_version=PROMPT_VERSION)
-
-# LangChain Evaluator
-llm = ChatOpenAI(temperature=0)
+if EVAL_FAKE_LLM:
+    # Modo offline: LLMs y embeddings locales sobre el índice por defecto (benchmark sin OpenAI)
+    from app.fakes import FakeChatModel, FakeEmbeddings, fake_answer, fake_score_grade, fake_batched_grade
+    FAKE_LATENCY = float(os.getenv("EVAL_FAKE_LATENCY", 0.5))
+    vectordb = load_vectorstore_from_disk(embeddings=FakeEmbeddings(latency=FAKE_LATENCY / 10))
+    chain = build_chain(vectordb, prompt_version=PROMPT_VERSION, llm=FakeChatModel(responder=fake_answer, latency=FAKE_LATENCY))
+    llm = FakeChatModel(responder=fake_batched_grade if GRADER_MODE == "batched" else fake_score_grade, latency=FAKE_LATENCY)
+    criterion_llm = FakeChatModel(responder=fake_score_grade, latency=FAKE_LATENCY)
+else:
+    # Vectorstore y cadena (índice del registro para CHUNK_SIZE/CHUNK_OVERLAP)
+    vectordb = load_vectorstore(CHUNK_SIZE, CHUNK_OVERLAP)
+    chain = build_chain(vectordb, prompt_version=PROMPT_VERSION)
+    # LangChain Evaluator
+    llm = criterion_llm = ChatOpenAI(temperature=0)
 
 # ✅ Criterios válidos como strings
 criteria = {
@@ -38,6 +60,7 @@ criteria = {
 }
 
 
+# Un evaluador por criterio: el modo per_criterion y el respaldo del modo batched
 eval_chain = []
 
 for c in criteria:
@@ -45,43 +68,135 @@ for c in criteria:
         {'eval':load_evaluator(
             "labeled_score_string",
             criteria={c : criteria[c]},
-            llm=llm,
+            llm=criterion_llm,
         ),
         'criteria':c
         }
     )
 
-# ✅ Establecer experimento una vez
-mlflow.set_experiment(f"eval_criteria_{PROMPT_VERSION}_{CHUNK_SIZE}")
-print(f"📊 MLflow Experiment: eval_criteria_{PROMPT_VERSION}")
-
-# Evaluación por lote
-for i, pair in enumerate(dataset):
+# ✅ Experimento y parámetros comunes de esta evaluación
+# Con rerank el experimento lleva sufijo, para comparar (A/B) contra el mismo prompt sin rerank
+EXPERIMENT = f"eval_criteria_{PROMPT_VERSION}_{CHUNK_SIZE}" + (f"_rerank_{RERANK}" if RERANK != "off" else "")
+writer = ResultsWriter(
+    EXPERIMENT,
+    run_name=EXPERIMENT,
+    params={
+        "prompt_version": PROMPT_VERSION,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "grader_mode": GRADER_MODE,
+        "rerank": RERANK,
+    },
+)
+print(f"📊 MLflow Experiment: {EXPERIMENT}")
+
+def responder(pair):
+    result, traza = call_with_retries(traced_invoke, chain, {"question": pair["question"], "chat_history": []})
+    # Tokens de contexto antes/después del armado (mismo hilo que la recuperación) y
+    # tiempos/tokens por etapa de la traza
+    return result["answer"], {**last_stats(), **traza}
+
+def calificar(item):
+    pair, respuesta_generada, eval_i = item
+    handler = TokenUsageHandler()
+    start = time.perf_counter()
+    graded = call_with_retries(
+        eval_i['eval'].evaluate_strings,
+        input=pair["question"],
+        prediction=respuesta_generada,
+        reference=pair["answer"],
+        callbacks=[handler]
+    )
+    usage = {"prompt_tokens": handler.prompt_tokens, "completion_tokens": handler.completion_tokens}
+    return {eval_i['criteria']: graded['score']}, usage, time.perf_counter() - start
+
+def calificar_por_criterio(pair, respuesta):
+    scores, usage, latency = {}, {"prompt_tokens": 0, "completion_tokens": 0}, 0.0
+    for eval_i in eval_chain:
+        score, u, t = calificar((pair, respuesta, eval_i))
+        scores.update(score)
+        usage = {k: usage[k] + u[k] for k in usage}
+        latency += t
+    return scores, usage, latency
+
+def calificar_lote(lote):
+    # Una sola llamada para todos los criterios de todas las respuestas del lote;
+    # tokens y latencia se reparten por igual entre las respuestas. Las respuestas sin
+    # calificación legible se reintentan y, si no, se califican con un evaluador por criterio.
+    items = [{"question": pair["question"], "reference": pair["answer"], "prediction": respuesta} for pair, respuesta in lote]
+    scores, usage, latency = [None] * len(items), {"prompt_tokens": 0, "completion_tokens": 0}, 0.0
+    pendientes = list(range(len(items)))
+    for intento in range(GRADER_PARSE_RETRIES + 1):
+        if intento:
+            print(f"⚠️ Evaluador sin calificación legible para {len(pendientes)} respuesta(s), reintento {intento}/{GRADER_PARSE_RETRIES}")
+        parciales, u, t = call_with_retries(grade_batch, llm, [items[j] for j in pendientes], criteria)
+        usage = {k: usage[k] + u[k] for k in usage}
+        latency += t
+        for j, score in zip(pendientes, parciales):
+            scores[j] = score
+        pendientes = [j for j in pendientes if scores[j] is None]
+        if not pendientes:
+            break
+    parte = {k: v / len(lote) for k, v in usage.items()}
+    resultados = []
+    for j, (pair, respuesta) in enumerate(lote):
+        score, u, t = scores[j], parte, latency / len(lote)
+        if score is None:
+            print(f"⚠️ Calificando por criterio: {pair['question']}")
+            score, extra, t_extra = calificar_por_criterio(pair, respuesta)
+            u, t = {k: u[k] + extra[k] for k in u}, t + t_extra
+        resultados.append((score, u, t))
+    return resultados
+
+# Evaluación concurrente: primero todas las respuestas y luego todas las
+# llamadas al evaluador
+respuestas, contextos = zip(*run_concurrent(responder, dataset, max_workers=EVAL_CONCURRENCY))
+writer.summary_metrics.update(percentiles(contextos))
+pares = list(zip(dataset, respuestas))
+if GRADER_MODE == "batched":
+    lotes = [pares[k:k + GRADER_BATCH_SIZE] for k in range(0, len(pares), GRADER_BATCH_SIZE)]
+    calificaciones = [c for lote in run_concurrent(calificar_lote, lotes, max_workers=EVAL_CONCURRENCY) for c in lote]
+else:
+    tareas = [(pair, respuesta, eval_i) for pair, respuesta in pares for eval_i in eval_chain]
+    parciales = run_concurrent(calificar, tareas, max_workers=EVAL_CONCURRENCY)
+    calificaciones = []
+    for i in range(len(pares)):
+        scores, usage, latency = {}, {"prompt_tokens": 0, "completion_tokens": 0}, 0.0
+        for score, u, t in parciales[i * len(eval_chain):(i + 1) * len(eval_chain)]:
+            scores.update(score)
+            usage = {k: usage[k] + u[k] for k in usage}
+            latency += t
+        calificaciones.append((scores, usage, latency))
+
+# Acumular resultados en el mismo orden del dataset
+for i, ((pair, respuesta_generada), (scores, usage, latency), contexto) in enumerate(zip(pares, calificaciones, contextos)):
     pregunta = pair["question"]
-    respuesta_esperada = pair["answer"]
-    with mlflow.start_run(run_name=f"eval_q{i+1}"):
-        result = chain.invoke({"question": pregunta, "chat_history": []})
-        respuesta_generada = result["answer"]
-
-
-        for eval_i in eval_chain:
-            graded = eval_i['eval'].evaluate_strings(
-                input=pregunta,
-                prediction=respuesta_generada,
-                reference=respuesta_esperada
-            )
-
-            # 🔍 Imprimir y guardar métricas
-            print(f"\n📦 Resultado evaluación con criterios para pregunta {i+1}/{len(dataset)}:")
-            mlflow.log_param("question", pregunta)
-            mlflow.log_param("prompt_version", PROMPT_VERSION)
-            mlflow.log_param("chunk_size", CHUNK_SIZE)
-            mlflow.log_param("chunk_overlap", CHUNK_OVERLAP)
-
-            criterion = eval_i['criteria']
-            score = graded['score']
-            print(f"{criterion.capitalize()}: {score}")
-            mlflow.log_metric(f"{criterion}_score", score)
-
-            print(f"✅ Pregunta: {pregunta}")
-            print(f"🧠 Respuesta generada: {respuesta_generada}")
+    # 🔍 Imprimir y guardar métricas
+    print(f"\n📦 Resultado evaluación con criterios para pregunta {i+1}/{len(dataset)}:")
+    for criterion in criteria:
+        print(f"{criterion.capitalize()}: {scores[criterion]}")
+
+    writer.add(
+        f"eval_q{i+1}",
+        params={
+            "question": pregunta,
+            "prompt_version": PROMPT_VERSION,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "grader_mode": GRADER_MODE,
+        },
+        metrics={
+            **{f"{criterion}_score": scores[criterion] for criterion in criteria},
+            # Costo del evaluador para comparar modos
+            "grader_prompt_tokens": usage["prompt_tokens"],
+            "grader_completion_tokens": usage["completion_tokens"],
+            "grader_latency_s": latency,
+            **contexto,
+        },
+    )
+
+    print(f"✅ Pregunta: {pregunta}")
+    print(f"🧠 Respuesta generada: {respuesta_generada}")
+
+# Log en MLflow en bloque (log_batch) + artefacto columnar con todos los resultados
+writer.flush()
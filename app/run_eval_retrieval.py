@@ -0,0 +1,95 @@
+import sys, os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Evaluación solo de la recuperación, sin LLM: compara los chunks recuperados con las páginas
+# de referencia ("gold_pages") de tests/eval_dataset.json y calcula recall@k, MRR y nDCG@k.
+# Todas las preguntas se recuperan juntas (un embed_documents y una búsqueda FAISS matricial),
+# así una configuración de índice se evalúa en segundos antes de pagar una evaluación completa.
+
+import json
+import math
+import time
+
+from dotenv import load_dotenv
+
+from app.rag_pipeline import INDEX_SPEC, RERANK, RETRIEVER_MODE, load_vectorstore, load_vectorstore_from_disk, make_retriever
+from app.results_writer import ResultsWriter
+
+load_dotenv()
+
+# Configuración
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 512))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 50))
+EVAL_KS = [int(k) for k in os.getenv("EVAL_KS", "1,3,5,10").split(",")]
+EVAL_FAKE_LLM = os.getenv("EVAL_FAKE_LLM", "0") == "1"
+DATASET_PATH = "tests/eval_dataset.json"
+
+
+def chunk_page(doc):
+    return os.path.basename(doc.metadata.get("source", "")), doc.metadata.get("page")
+
+
+def retrieval_metrics(pages, gold, ks=EVAL_KS):
+    # pages: (archivo, página) de cada chunk recuperado, en orden. Un chunk es relevante si su
+    # página está en gold; para nDCG solo cuenta el primer chunk de cada página de referencia
+    first_hit = {}
+    for rank, page in enumerate(pages):
+        if page in gold and page not in first_hit:
+            first_hit[page] = rank
+    ranks = sorted(first_hit.values())
+    metrics = {"mrr": 1.0 / (ranks[0] + 1) if ranks else 0.0}
+    for k in ks:
+        dcg = sum(1.0 / math.log2(rank + 2) for rank in ranks if rank < k)
+        idcg = sum(1.0 / math.log2(rank + 2) for rank in range(min(len(gold), k)))
+        metrics[f"recall_at_{k}"] = sum(rank < k for rank in ranks) / len(gold)
+        metrics[f"ndcg_at_{k}"] = dcg / idcg
+    return metrics
+
+
+def main():
+    with open(DATASET_PATH) as f:
+        dataset = [pair for pair in json.load(f) if pair.get("gold_pages")]
+
+    if EVAL_FAKE_LLM:
+        # Modo offline: embeddings locales sobre el índice por defecto
+        from app.fakes import FakeEmbeddings
+        vectordb = load_vectorstore_from_disk(embeddings=FakeEmbeddings(), mmap=True)
+    else:
+        vectordb = load_vectorstore(CHUNK_SIZE, CHUNK_OVERLAP)
+    retriever = make_retriever(vectordb, k=max(EVAL_KS), max_tokens=0)
+
+    start = time.perf_counter()
+    results = retriever.retrieve_batch([pair["question"] for pair in dataset])
+    retrieval_s = time.perf_counter() - start
+
+    run_name = f"retrieval_cs{CHUNK_SIZE}_co{CHUNK_OVERLAP}_{RETRIEVER_MODE}" + (f"_rerank_{RERANK}" if RERANK != "off" else "")
+    writer = ResultsWriter(
+        "retrieval_eval",
+        run_name=run_name,
+        params={
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "retriever_mode": RETRIEVER_MODE,
+            "rerank": RERANK,
+            "index_spec": INDEX_SPEC,
+            "ks": ",".join(map(str, EVAL_KS)),
+        },
+    )
+    for i, (pair, docs) in enumerate(zip(dataset, results)):
+        gold = {(g["source"], g["page"]) for g in pair["gold_pages"]}
+        writer.add(
+            f"retrieval_q{i+1}",
+            params={"question": pair["question"], "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP},
+            metrics=retrieval_metrics([chunk_page(doc) for doc in docs], gold),
+        )
+    writer.summary_metrics.update({"retrieval_s": retrieval_s, "n_questions": len(dataset)})
+
+    summary = writer.to_dataframe()[list(writer.rows[0]["metrics"])].mean() if writer.rows else {}
+    print(f"🔎 {run_name}: {len(dataset)} preguntas en {retrieval_s:.2f}s")
+    for name, value in summary.items():
+        print(f"  {name}: {value:.3f}")
+    writer.flush()
+
+
+if __name__ == "__main__":
+    main()
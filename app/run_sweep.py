@@ -0,0 +1,232 @@
+import sys, os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Barrido de parámetros de evaluación (prompt x chunk_size x chunk_overlap x k x modelo) sin
+# repetir trabajo compartido entre celdas:
+#   - un índice por configuración de chunking (registro de índices de rag_pipeline)
+#   - una recuperación por (índice, k), compartida entre prompts y modelos
+#   - respuestas en caché por (modelo, prompt completo = plantilla + contexto + pregunta) y
+#     calificaciones por (modelo calificador, pregunta, referencia, respuesta), en SQLite entre ejecuciones
+# Solo corren las celdas que no están ya en el experimento SWEEP_EXPERIMENT (prefijo "eval_",
+# así lo listan los dashboards); cada celda es un run padre con un run hijo por pregunta.
+
+import hashlib
+import itertools
+import json
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+from langchain.evaluation.qa import QAEvalChain
+from mlflow.tracking import MlflowClient
+
+from app.eval_engine import call_with_retries, run_concurrent
+from app.rag_pipeline import PROMPT_DIR, count_tokens, get_llm, load_prompt, load_vectorstore, load_vectorstore_from_disk, make_retriever
+from app.results_writer import SUMMARY_TAG, ResultsWriter
+
+load_dotenv()
+
+
+def _grid(name, default, cast=str):
+    return [cast(value.strip()) for value in os.getenv(name, default).split(",") if value.strip()]
+
+
+# Configuración
+SWEEP_PROMPTS = _grid("SWEEP_PROMPTS", ",".join(sorted(f[:-4] for f in os.listdir(PROMPT_DIR) if f.endswith(".txt"))))
+SWEEP_CHUNK_SIZES = _grid("SWEEP_CHUNK_SIZES", "512,1024", int)
+SWEEP_CHUNK_OVERLAPS = _grid("SWEEP_CHUNK_OVERLAPS", "50,100", int)
+SWEEP_K = _grid("SWEEP_K", "4", int)
+SWEEP_MODELS = _grid("SWEEP_MODELS", "gpt-4o")
+SWEEP_EXPERIMENT = os.getenv("SWEEP_EXPERIMENT", "eval_sweep")
+SWEEP_CACHE_PATH = os.getenv("SWEEP_CACHE_PATH", ".cache/sweep_cache.sqlite")
+SWEEP_FORCE = os.getenv("SWEEP_FORCE", "0") == "1"  # volver a correr celdas ya registradas
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", 4))
+EVAL_FAKE_LLM = os.getenv("EVAL_FAKE_LLM", "0") == "1"
+FAKE_LATENCY = float(os.getenv("EVAL_FAKE_LATENCY", 0.5))
+DATASET_PATH = "tests/eval_dataset.json"
+
+
+class SweepCache:
+    # Valores JSON por clave en SQLite; compartido por los hilos del barrido
+
+    def __init__(self, path=SWEEP_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?)", (key, json.dumps(value)))
+            self._conn.commit()
+
+
+def cache_key(kind, *parts):
+    return kind + ":" + hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def cell_id(prompt_version, chunk_size, chunk_overlap, k, model):
+    return f"{prompt_version}|cs{chunk_size}|co{chunk_overlap}|k{k}|{model}"
+
+
+def registered_cells():
+    client = MlflowClient()
+    experiment = client.get_experiment_by_name(SWEEP_EXPERIMENT)
+    if experiment is None:
+        return set()
+    runs = client.search_runs([experiment.experiment_id], filter_string=f"tags.{SUMMARY_TAG} = 'summary'", max_results=5000)
+    return {run.data.params.get("cell") for run in runs}
+
+
+if EVAL_FAKE_LLM:
+    # Modo offline: todas las configuraciones de chunking usan el índice por defecto
+    from app.fakes import FakeChatModel, FakeEmbeddings, fake_answer, fake_qa_grade
+    _fake_embeddings = FakeEmbeddings(latency=FAKE_LATENCY / 10)
+    _fake_llm = FakeChatModel(responder=fake_answer, latency=FAKE_LATENCY)
+
+    def load_index(chunk_size, chunk_overlap):
+        return load_vectorstore_from_disk(embeddings=_fake_embeddings, mmap=True)
+
+    def answer_llm(model):
+        return _fake_llm
+
+    grader_llm = FakeChatModel(responder=fake_qa_grade, latency=FAKE_LATENCY)
+    grader_model = "fake-qa-grade"
+else:
+    from langchain_openai import ChatOpenAI
+
+    load_index = load_vectorstore
+
+    def answer_llm(model):
+        return get_llm(model, temperature=0)
+
+    grader_llm = ChatOpenAI(temperature=0)
+    grader_model = grader_llm.model_name
+
+qa_grader = QAEvalChain.from_llm(grader_llm)
+
+
+def generate(task):
+    key, (model, prompt_value) = task
+    start = time.perf_counter()
+    message = call_with_retries(answer_llm(model).invoke, prompt_value)
+    usage = getattr(message, "usage_metadata", None) or {}
+    record = {
+        "answer": message.content,
+        "generate_s": time.perf_counter() - start,
+        "prompt_tokens": usage.get("input_tokens") or count_tokens(prompt_value.to_string()),
+        "completion_tokens": usage.get("output_tokens") or count_tokens(message.content),
+    }
+    cache.put(key, record)
+    return record
+
+
+def grade(task):
+    key, (pair, answer) = task
+    graded = call_with_retries(
+        qa_grader.evaluate_strings,
+        input=pair["question"],
+        prediction=answer,
+        reference=pair["answer"],
+    )
+    record = {"lc_is_correct": graded.get("score", 0) or 0}
+    cache.put(key, record)
+    return record
+
+
+cache = SweepCache()
+
+
+def main():
+    with open(DATASET_PATH) as f:
+        dataset = json.load(f)
+    questions = [pair["question"] for pair in dataset]
+
+    cells = [c for c in itertools.product(SWEEP_PROMPTS, SWEEP_CHUNK_SIZES, SWEEP_CHUNK_OVERLAPS, SWEEP_K, SWEEP_MODELS)
+             if c[2] < c[1]]
+    done = set() if SWEEP_FORCE else registered_cells()
+    pending = [c for c in cells if cell_id(*c) not in done]
+    chunkings = sorted({(cs, co) for _, cs, co, _, _ in pending})
+    retrieval_keys = sorted({(cs, co, k) for _, cs, co, k, _ in pending})
+    print(f"🧮 {len(cells)} celdas, {len(cells) - len(pending)} ya registradas en '{SWEEP_EXPERIMENT}'; "
+          f"pendientes {len(pending)}: {len(chunkings)} índices, {len(retrieval_keys)} recuperaciones")
+    if not pending:
+        return
+
+    # 1. Un índice por configuración de chunking
+    indexes = {(cs, co): load_index(cs, co) for cs, co in chunkings}
+
+    # 2. Una recuperación por (índice, k) para todas las preguntas, compartida entre prompts y modelos
+    retrievals = {}
+    for cs, co, k in retrieval_keys:
+        start = time.perf_counter()
+        docs = make_retriever(indexes[(cs, co)], k=k).retrieve_batch(questions)
+        retrievals[(cs, co, k)] = (docs, (time.perf_counter() - start) / len(questions))
+
+    # 3. Respuestas: una por prompt completo distinto; las que están en caché no se regeneran.
+    # El contexto se arma igual que StuffDocumentsChain (page_content separados por línea en blanco)
+    answer_keys, tasks = {}, {}
+    for cell in pending:
+        prompt_version, cs, co, k, model = cell
+        template = load_prompt(prompt_version)
+        answer_keys[cell] = []
+        for question, docs in zip(questions, retrievals[(cs, co, k)][0]):
+            prompt_value = template.format_prompt(context="\n\n".join(d.page_content for d in docs), question=question)
+            key = cache_key("answer", model, prompt_value.to_string())
+            answer_keys[cell].append(key)
+            if key not in tasks and cache.get(key) is None:
+                tasks[key] = (model, prompt_value)
+    print(f"💬 {len(tasks)} respuestas por generar de {sum(len(keys) for keys in answer_keys.values())}")
+    run_concurrent(generate, list(tasks.items()), max_workers=EVAL_CONCURRENCY)
+    answers = {key: cache.get(key) for keys in answer_keys.values() for key in keys}
+
+    # 4. Calificaciones por (modelo calificador, pregunta, referencia, respuesta): cambiar de
+    # calificador no reutiliza notas de otro
+    grade_keys, grade_tasks = {}, {}
+    for cell in pending:
+        grade_keys[cell] = []
+        for pair, key in zip(dataset, answer_keys[cell]):
+            answer = answers[key]["answer"]
+            g_key = cache_key("grade_qa", grader_model, pair["question"], pair["answer"], answer)
+            grade_keys[cell].append(g_key)
+            if g_key not in grade_tasks and cache.get(g_key) is None:
+                grade_tasks[g_key] = (pair, answer)
+    print(f"🧠 {len(grade_tasks)} calificaciones por hacer")
+    run_concurrent(grade, list(grade_tasks.items()), max_workers=EVAL_CONCURRENCY)
+    grades = {key: cache.get(key) for keys in grade_keys.values() for key in keys}
+
+    # 5. Un run padre por celda en el experimento del barrido
+    for cell in pending:
+        prompt_version, cs, co, k, model = cell
+        params = {"prompt_version": prompt_version, "chunk_size": cs, "chunk_overlap": co, "k": k, "model": model}
+        writer = ResultsWriter(SWEEP_EXPERIMENT, run_name=cell_id(*cell), params={"cell": cell_id(*cell), **params})
+        retrieval_s = retrievals[(cs, co, k)][1]
+        generated = 0
+        for i, (pair, a_key, g_key) in enumerate(zip(dataset, answer_keys[cell], grade_keys[cell])):
+            answer, cached = answers[a_key], a_key not in tasks
+            generated += not cached
+            writer.add(
+                f"eval_q{i+1}",
+                params={"question": pair["question"], **params},
+                metrics={
+                    "lc_is_correct": grades[g_key]["lc_is_correct"],
+                    "retrieval_s": retrieval_s,
+                    "generate_s": answer["generate_s"],
+                    "generate_prompt_tokens": answer["prompt_tokens"],
+                    "generate_completion_tokens": answer["completion_tokens"],
+                    "answer_cached": int(cached),
+                },
+            )
+        writer.summary_metrics.update({"n_answers_generated": generated, "n_answers_cached": len(dataset) - generated})
+        writer.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# app/semantic_cache.py
+# Caché semántica de respuestas: si llega una pregunta casi idéntica (similitud coseno sobre
+# embeddings por encima del umbral) a una ya respondida, se devuelve la respuesta guardada.
+# Las entradas viven en un espacio de nombres (versión de prompt + hash del corpus), así que
+# cambiar cualquiera de los dos invalida la caché. Expiran por TTL y se desalojan por LRU.
+# Preguntas que solo difieren en un identificador (IW/EW, GRD/SLC, reporte 440/441) quedan muy
+# por encima del umbral, así que además deben tener los mismos identificadores.
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+from app.hybrid_retriever import identifier_terms
+
+LOOKUP_CANDIDATES = 4  # vecinos sobre el umbral que se revisan buscando los mismos identificadores
+
+
+class SemanticCache:
+
+    def __init__(self, embeddings, threshold=0.95, ttl_s=86400, max_entries=1000):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # id -> (namespace, question, answer, created_at); orden LRU
+        self._indexes = {}  # namespace -> índice FAISS (producto interno sobre vectores normalizados)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _vector(self, question):
+        vector = np.array([self.embeddings.embed_query(question)], dtype="float32")
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _remove(self, entry_id):
+        namespace = self._entries.pop(entry_id)[0]
+        self._indexes[namespace].remove_ids(np.array([entry_id], dtype="int64"))
+
+    def _expire(self):
+        now = time.time()
+        expired = [i for i, entry in self._entries.items() if now - entry[3] > self.ttl_s]
+        for entry_id in expired:
+            self._remove(entry_id)
+
+    def lookup(self, namespace, question):
+        vector = self._vector(question)
+        with self._lock:
+            self._expire()
+            index = self._indexes.get(namespace)
+            if index is not None and index.ntotal:
+                identifiers = identifier_terms(question)
+                scores, ids = index.search(vector, min(LOOKUP_CANDIDATES, index.ntotal))
+                for score, entry_id in zip(scores[0], ids[0]):
+                    if entry_id < 0 or score < self.threshold:
+                        break
+                    entry = self._entries[int(entry_id)]
+                    if identifier_terms(entry[1]) == identifiers:
+                        self.hits += 1
+                        self._entries.move_to_end(int(entry_id))
+                        return entry[2]
+            self.misses += 1
+            return None
+
+    def store(self, namespace, question, answer):
+        vector = self._vector(question)
+        with self._lock:
+            if namespace not in self._indexes:
+                self._indexes[namespace] = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            entry_id = next(self._ids)
+            self._indexes[namespace].add_with_ids(vector, np.array([entry_id], dtype="int64"))
+            self._entries[entry_id] = (namespace, question, answer, time.time())
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "semantic_cache_hits": self.hits,
+            "semantic_cache_misses": self.misses,
+            "semantic_cache_hit_rate": self.hits / total if total else 0.0,
+            "semantic_cache_entries": len(self._entries),
+        }
+
+    def log_to_mlflow(self, experiment_name="semantic_cache"):
+        # Cliente directo (no la API fluida) porque se llama desde hilos de Streamlit
+        from mlflow.tracking import MlflowClient
+        client = MlflowClient()
+        experiment = client.get_experiment_by_name(experiment_name)
+        experiment_id = experiment.experiment_id if experiment else client.create_experiment(experiment_name)
+        run = client.create_run(experiment_id, run_name="semantic_cache_stats")
+        for key, value in self.stats().items():
+            client.log_metric(run.info.run_id, key, value)
+        client.log_param(run.info.run_id, "threshold", self.threshold)
+        client.set_terminated(run.info.run_id)
@@ -0,0 +1,306 @@
+# app/service.py
+# Servicio HTTP (ASGI, sin framework) sobre rag_pipeline para servir a muchos usuarios desde
+# un solo contenedor:
+#   POST /ask          {"question": ..., "chat_history": [[pregunta, respuesta], ...]} -> JSON
+#   POST /ask/stream   mismo cuerpo -> text/event-stream con un evento por token
+#   GET  /health
+# El índice y la cadena se cargan una vez por proceso. Las preguntas concurrentes se agrupan
+# (micro-batching) para que sus embeddings salgan en una sola llamada y la búsqueda FAISS sea
+# una consulta matricial. Con más de SERVICE_MAX_CONCURRENCY respuestas en curso las demás
+# esperan, y si además hay SERVICE_MAX_QUEUE en espera se responde 503 (backpressure).
+#
+#   uvicorn app.service:app --host 0.0.0.0 --port 8000
+
+import sys, os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import json
+import time
+
+from dotenv import load_dotenv
+
+from app.hybrid_retriever import is_keyword_query
+from app.rag_pipeline import (
+    SEMANTIC_CACHE, VECTOR_DIR, _combine_prompt, _generation_stats, _stream_inputs, _token_text, build_chain,
+    corpus_fingerprint, get_chain, get_semantic_cache, load_vectorstore_from_disk, prepare_chat_history, trace_sink,
+)
+from app.tracing import Trace, activate, stage
+
+load_dotenv()
+
+# Configuración
+PROMPT_VERSION = os.getenv("PROMPT_VERSION", "v1_asistente_cientifico")
+SERVICE_MAX_CONCURRENCY = int(os.getenv("SERVICE_MAX_CONCURRENCY", 16))
+SERVICE_MAX_QUEUE = int(os.getenv("SERVICE_MAX_QUEUE", 64))
+SERVICE_BATCH_SIZE = int(os.getenv("SERVICE_BATCH_SIZE", 32))
+SERVICE_BATCH_WAIT_MS = float(os.getenv("SERVICE_BATCH_WAIT_MS", 10))
+SERVICE_FAKE_LLM = os.getenv("SERVICE_FAKE_LLM", "0") == "1"
+
+
+class Overloaded(Exception):
+    pass
+
+
+class RetrievalBatcher:
+    # Junta las preguntas que llegan dentro de SERVICE_BATCH_WAIT_MS (hasta SERVICE_BATCH_SIZE)
+    # y las recupera con retriever.retrieve_batch en un hilo. Cada pregunta recibe sus documentos
+    # y la traza del batch (embed_s, bm25_search_s, faiss_search_s): es lo que esperó por ellos.
+
+    def __init__(self, get_retriever, max_size=SERVICE_BATCH_SIZE, max_wait_s=SERVICE_BATCH_WAIT_MS / 1000):
+        self.get_retriever = get_retriever
+        self.max_size = max_size
+        self.max_wait_s = max_wait_s
+        self.batch_sizes = []
+        self._queue = None
+        self._worker = None
+
+    async def retrieve(self, question):
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((question, future))
+        return await future
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait_s
+        while len(batch) < self.max_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _retrieve(self, questions):
+        trace = Trace()
+        with activate(trace):
+            results = self.get_retriever().retrieve_batch(questions)
+        return results, trace.as_metrics()
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            self.batch_sizes.append(len(batch))
+            try:
+                results, metrics = await asyncio.to_thread(self._retrieve, [q for q, _ in batch])
+            except Exception as e:
+                results, metrics = [e] * len(batch), {}
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result((result, metrics))
+
+
+class RAGService:
+
+    def __init__(self, max_concurrency=SERVICE_MAX_CONCURRENCY, max_queue=SERVICE_MAX_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._semaphore = None
+        self._fake_chain = None
+        self.batcher = RetrievalBatcher(lambda: self.chain().retriever)
+
+    def chain(self):
+        if SERVICE_FAKE_LLM:
+            # Modo offline (pruebas de carga sin OpenAI), igual que EVAL_FAKE_LLM en las evaluaciones
+            if self._fake_chain is None:
+                from app.fakes import FakeChatModel, FakeEmbeddings, fake_answer
+                latency = float(os.getenv("SERVICE_FAKE_LATENCY", 0.5))
+                vectordb = load_vectorstore_from_disk(embeddings=FakeEmbeddings(latency=latency / 10), mmap=True)
+                self._fake_chain = build_chain(vectordb, PROMPT_VERSION, llm=FakeChatModel(responder=fake_answer, latency=latency))
+            return self._fake_chain
+        # Cadena compartida del proceso; se recarga sola si el índice cambia en disco
+        return get_chain(PROMPT_VERSION, VECTOR_DIR)
+
+    async def startup(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        await asyncio.to_thread(self.chain)
+
+    def admit(self):
+        if self.in_flight >= self.max_concurrency + self.max_queue:
+            raise Overloaded()
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+
+    async def answer_tokens(self, question, chat_history, timings):
+        # Mismo flujo y mismas etapas que rag_pipeline.stream_answer, con la recuperación en
+        # micro-batches
+        start = time.perf_counter()
+        async with self._semaphore:
+            timings["queue_s"] = time.perf_counter() - start
+            chain = self.chain()
+            history = prepare_chat_history(question, chat_history)
+            cache_key = None
+            if SEMANTIC_CACHE and not SERVICE_FAKE_LLM and not history and not is_keyword_query(question):
+                cache = get_semantic_cache()
+                cache_key = (PROMPT_VERSION, corpus_fingerprint(VECTOR_DIR))
+                answer = await asyncio.to_thread(cache.lookup, cache_key, question)
+                timings["cache_hit"] = answer is not None
+                if answer is not None:
+                    timings["ttft_s"] = timings["total_s"] = time.perf_counter() - start
+                    yield answer
+                    return
+
+            trace = Trace()
+            with activate(trace):
+                standalone, chat_history_str = _stream_inputs(chain, question, history)
+                if chat_history_str:
+                    with stage("condense"):
+                        result = await chain.question_generator.ainvoke({"question": standalone, "chat_history": chat_history_str})
+                        standalone = result["text"]
+                with stage("retrieval"):
+                    docs, batch_metrics = await self.batcher.retrieve(standalone)
+            for name, value in batch_metrics.items():
+                trace.add(name, value)
+            timings.update(trace.as_metrics())
+            prompt_value = _combine_prompt(chain, docs, standalone, chat_history_str)
+
+            generation_start = time.perf_counter()
+            tokens = []
+            async for chunk in chain.combine_docs_chain.llm_chain.llm.astream(prompt_value):
+                if not tokens:
+                    timings["ttft_s"] = time.perf_counter() - start
+                tokens.append(_token_text(chunk))
+                yield tokens[-1]
+            _generation_stats(timings, docs, prompt_value, tokens, generation_start)
+            timings["total_s"] = time.perf_counter() - start
+            if cache_key is not None:
+                await asyncio.to_thread(get_semantic_cache().store, cache_key, question, "".join(tokens))
+
+
+service = RAGService()
+
+
+# --- ASGI ---
+
+async def _read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return json.loads(body or b"{}")
+
+
+async def _send_json(send, status, payload, headers=()):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await service.startup()
+                await send({"type": "lifespan.startup.complete"})
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def _ask(send, request, stream):
+    timings = {}
+    tokens = service.answer_tokens(request["question"], request.get("chat_history") or [], timings)
+    if not stream:
+        answer = "".join([token async for token in tokens])
+        await asyncio.to_thread(trace_sink.write, timings)
+        await _send_json(send, 200, {"answer": answer, "timings": timings})
+        return
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+    })
+    # Con la respuesta ya iniciada no se puede devolver un 500: un fallo a mitad de la
+    # generación (LLM, recuperación, cola) se informa con un evento "error" que cierra el stream
+    try:
+        async for token in tokens:
+            data = json.dumps({"token": token}, ensure_ascii=False)
+            await send({"type": "http.response.body", "body": f"data: {data}\n\n".encode("utf-8"), "more_body": True})
+    except Exception as e:
+        print(f"⚠️ Error generando la respuesta en streaming: {e!r}")
+        error = json.dumps({"error": str(e) or type(e).__name__}, ensure_ascii=False)
+        await send({"type": "http.response.body", "body": f"event: error\ndata: {error}\n\n".encode("utf-8")})
+        return
+    await asyncio.to_thread(trace_sink.write, timings)
+    done = json.dumps({"timings": timings})
+    await send({"type": "http.response.body", "body": f"event: done\ndata: {done}\n\n".encode("utf-8")})
+
+
+def _validate(request):
+    # Mensaje de error para un cuerpo inválido (None si es válido); se revisa antes de admit()
+    # para que un cuerpo mal formado sea un 400 y no un 500 a mitad de la generación
+    if not isinstance(request, dict):
+        return "JSON body must be an object"
+    if not isinstance(request.get("question"), str) or not request["question"].strip():
+        return "'question' is required"
+    history = request.get("chat_history")
+    if history is None:
+        return None
+    if not isinstance(history, list) or not all(
+        isinstance(turn, list) and len(turn) == 2 and all(isinstance(t, str) for t in turn) for turn in history
+    ):
+        return "'chat_history' must be a list of [question, answer] string pairs"
+    return None
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    if service._semaphore is None:
+        await service.startup()  # servidores sin lifespan
+
+    path, method = scope["path"].rstrip("/"), scope["method"]
+    if path == "/health" and method == "GET":
+        await _send_json(send, 200, {"status": "ok", "in_flight": service.in_flight})
+        return
+    if path not in ("/ask", "/ask/stream"):
+        await _send_json(send, 404, {"error": "not found"})
+        return
+    if method != "POST":
+        await _send_json(send, 405, {"error": "method not allowed"})
+        return
+
+    try:
+        request = await _read_json(receive)
+    except ValueError:
+        await _send_json(send, 400, {"error": "invalid JSON body"})
+        return
+    error = _validate(request)
+    if error:
+        await _send_json(send, 400, {"error": error})
+        return
+
+    try:
+        service.admit()
+    except Overloaded:
+        await _send_json(send, 503, {"error": "overloaded, retry later"}, headers=[(b"retry-after", b"1")])
+        return
+    try:
+        await _ask(send, request, stream=path == "/ask/stream")
+    finally:
+        service.release()
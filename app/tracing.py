@@ -0,0 +1,167 @@
+# app/tracing.py
+# Trazas por request: tiempo de cada etapa (condensar pregunta, recuperación y dentro de ella
+# embedding, BM25 y FAISS, generación), tokens de prompt/completion y chunks recuperados.
+# Las etapas internas se miden con timers por contexto (stage): la traza activa es una ContextVar,
+# así sigue a la tarea asyncio y a los hilos de run_in_executor/asyncio.to_thread (copian el
+# contexto). Las etapas de la cadena se miden con un callback.
+# Las trazas se agregan en percentiles p50/p95/p99: a MLflow en las evaluaciones y a un
+# archivo JSONL local que lee el panel de latencias de las UIs de Streamlit.
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+
+TRACE_SINK_PATH = os.getenv("TRACE_SINK_PATH", ".cache/traces.jsonl")
+TRACE_SINK_MAX_BYTES = int(os.getenv("TRACE_SINK_MAX_BYTES", 10 * 1024 * 1024))  # 0 = sin límite
+
+_trace = ContextVar("trace", default=None)
+
+
+class Trace:
+
+    def __init__(self):
+        self.values = {}  # "<etapa>_s" -> segundos, contadores -> enteros
+
+    def add(self, name, value):
+        self.values[name] = self.values.get(name, 0) + value
+
+    def as_metrics(self):
+        return dict(self.values)
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextmanager
+def activate(trace):
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def stage(name):
+    # Suma la duración del bloque a la traza activa (no hace nada si no hay traza)
+    trace = current_trace()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace.add(f"{name}_s", time.perf_counter() - start)
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    # Etapas de ConversationalRetrievalChain: la llamada al LLM dentro de StuffDocumentsChain es
+    # la generación, cualquier otra es condensar la pregunta; se mide el retriever más externo
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._runs = {}  # run_id -> (parent_run_id, nombre, inicio)
+
+    def _inside(self, run_id, name):
+        while run_id in self._runs:
+            parent, run_name, _ = self._runs[run_id]
+            if run_name == name:
+                return True
+            run_id = parent
+        return False
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self._runs[run_id] = (parent_run_id, kwargs.get("name"), None)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._runs[run_id] = (parent_run_id, "llm", time.perf_counter())
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._runs[run_id] = (parent_run_id, "llm", time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        parent, _, start = self._runs[run_id]
+        name = "generate" if self._inside(parent, "StuffDocumentsChain") else "condense"
+        self.trace.add(f"{name}_s", time.perf_counter() - start)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        self.trace.add(f"{name}_prompt_tokens", usage.get("prompt_tokens", 0))
+        self.trace.add(f"{name}_completion_tokens", usage.get("completion_tokens", 0))
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._runs[run_id] = (parent_run_id, "retriever", time.perf_counter())
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        parent, _, start = self._runs[run_id]
+        if not self._inside(parent, "retriever"):
+            self.trace.add("retrieval_s", time.perf_counter() - start)
+            self.trace.add("n_docs", len(documents))
+
+
+def traced_invoke(chain, inputs):
+    # chain.invoke con traza; devuelve (resultado, métricas de la traza)
+    trace = Trace()
+    start = time.perf_counter()
+    with activate(trace):
+        result = chain.invoke(inputs, config={"callbacks": [TraceCallbackHandler(trace)]})
+    trace.add("total_s", time.perf_counter() - start)
+    return result, trace.as_metrics()
+
+
+def percentiles(rows, quantiles=(50, 95, 99)):
+    # {"<etapa>_s_p50": ...} para cada etapa presente en las trazas
+    keys = sorted({key for row in rows for key in row if key.endswith("_s")})
+    summary = {}
+    for key in keys:
+        values = [row[key] for row in rows if key in row]
+        for q in quantiles:
+            summary[f"{key}_p{q}"] = float(np.percentile(values, q))
+    return summary
+
+
+def _tail(path, limit, block=64 * 1024):
+    # Últimas `limit` líneas leyendo bloques desde el final: no se recorre el archivo completo
+    if limit <= 0 or not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        data = b""
+        while end > 0 and data.count(b"\n") <= limit:
+            start = max(0, end - block)
+            f.seek(start)
+            data = f.read(end - start) + data
+            end = start
+    return [line for line in data.decode("utf-8", errors="replace").splitlines() if line.strip()][-limit:]
+
+
+class LocalTraceSink:
+    # JSONL append-only para las UIs; read() devuelve las últimas `limit` trazas. Al pasar de
+    # max_bytes el archivo se rota a "<path>.1" (se conserva una sola rotación), así que el
+    # disco usado queda acotado en ~2 * max_bytes
+
+    def __init__(self, path=TRACE_SINK_PATH, max_bytes=TRACE_SINK_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def write(self, metrics):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        line = json.dumps({"timestamp": time.time(), **metrics})
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+                size = f.tell()
+            if self.max_bytes > 0 and size >= self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+
+    def read(self, limit=1000):
+        lines = _tail(self.path, limit)
+        if len(lines) < limit:
+            lines = _tail(self.path + ".1", limit - len(lines)) + lines
+        return [json.loads(line) for line in lines]
@@ -2,30 +2,54 @@
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+import uuid
+
 import streamlit as st
 st.set_page_config(page_title="🤖🚀 Satellite Assistant", layout="centered")
 
-from app.rag_pipeline import load_vectorstore_from_disk, build_chain
+from app.rag_pipeline import answer_stream, prepare_chat_history, warm_up
+
+
+@st.cache_resource(show_spinner=False)
+def precargar():
+    # Una vez por proceso: índice y cadena se cargan mientras se muestra la página
+    return warm_up()
 
+precargar()
 
 st.title("🤖🚀 Satellite Assistant")
 
-question = st.text_input("What do you want to know? / ¿Qué deseas consultar? / 何をお知りになりたいですか？ ")
+# En un formulario la consulta sale solo al enviarlo (botón o Enter), no en cada re-ejecución
+# del script; así se puede repetir la misma pregunta o reintentarla tras un error
+with st.form("question"):
+    question = st.text_input("What do you want to know? / ¿Qué deseas consultar? / 何をお知りになりたいですか？ ")
+    submitted = st.form_submit_button("Ask")
 
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
-
-# Cargar vectorstore y cadena
-vectordb = load_vectorstore_from_disk()
-chain = build_chain(vectordb)
-
-if question:
-    with st.spinner("Thinking..."):
-        result = chain.invoke({"question": question, "chat_history": st.session_state.chat_history})
-        st.session_state.chat_history.append((question, result["answer"]))
-
-if st.session_state.chat_history:
+    st.session_state.summary = {}
+    st.session_state.session_id = uuid.uuid4().hex  # turnos y límite por sesión en el coordinador
+
+historial = st.session_state.chat_history
+if submitted and question.strip():
+    st.markdown("---")
+    st.markdown(f"**🧑 User:** {question}")
+    placeholder = st.empty()
+    timings = {}
+    answer = ""
+    # La respuesta se muestra token a token; al modelo solo llega el historial acotado
+    context = prepare_chat_history(question, historial, st.session_state.summary)
+    for token in answer_stream(question, context, timings, session_id=st.session_state.session_id):
+        answer += token
+        placeholder.markdown(f"**🤖 Bot:** {answer}▌")
+    placeholder.markdown(f"**🤖 Bot:** {answer}")
+    source = " · 💾 cached" if timings.get("cache_hit") else " · 🔗 shared" if timings.get("coalesced") else ""
+    st.caption(f"⏱️ First token: {timings.get('ttft_s', 0):.2f}s · Total: {timings['total_s']:.2f}s{source}")
+    historial = list(historial)
+    st.session_state.chat_history.append((question, answer))
+
+if historial:
     st.markdown("---")    
-    for q, a in reversed(st.session_state.chat_history):
+    for q, a in reversed(historial):
         st.markdown(f"**🧑 User:** {q}")
         st.markdown(f"**🤖 Bot:** {a}")
@@ -0,0 +1,148 @@
+# tests/test_ingest.py
+# Reconstrucción incremental de app.ingest.save_vectorstore sin OpenAI: corpus sintético de
+# app.benchmark, FakeEmbeddings detrás de la caché de embeddings y MLflow en un directorio
+# temporal. Se cuenta cuántos textos pide cada reconstrucción a los embeddings.
+
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("fpdf")
+mlflow = pytest.importorskip("mlflow")
+
+from app.benchmark import BENCH_PAGES_PER_PDF, write_corpus
+from app.fakes import FakeEmbeddings
+from app.ingest import save_vectorstore
+from app.rag_pipeline import get_embeddings, load_manifest
+
+CHUNK_SIZE, CHUNK_OVERLAP = 512, 50
+
+
+@pytest.fixture(autouse=True)
+def mlflow_temporal(tmp_path):
+    previous = mlflow.get_tracking_uri()
+    mlflow.set_tracking_uri(f"file://{tmp_path / 'mlruns'}")
+    yield
+    mlflow.set_tracking_uri(previous)
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    # report_0000 y report_0001 de 10 páginas; "recortado" tiene solo las 5 primeras páginas
+    # de report_0001 (mismo texto: write_corpus es determinista por semilla)
+    original, recortado, data = tmp_path / "original", tmp_path / "recortado", tmp_path / "pdfs"
+    write_corpus(str(original), 2 * BENCH_PAGES_PER_PDF)
+    write_corpus(str(recortado), BENCH_PAGES_PER_PDF + BENCH_PAGES_PER_PDF // 2)
+    shutil.copytree(original, data)
+    return {"original": original, "recortado": recortado, "data": data}
+
+
+@pytest.fixture
+def build(tmp_path, corpus):
+    embeddings = get_embeddings(cache_path=str(tmp_path / "embedding_cache.sqlite"), backend=FakeEmbeddings(size=64))
+    persist_path = str(tmp_path / "vectorstore")
+
+    def _build(index_spec="Flat"):
+        # (vectordb, manifest, textos que pidió esta reconstrucción a los embeddings)
+        before = embeddings.hits + embeddings.misses
+        vectordb = save_vectorstore(CHUNK_SIZE, CHUNK_OVERLAP, persist_path=persist_path, data_path=str(corpus["data"]),
+                                    index_spec=index_spec, embeddings=embeddings)
+        return vectordb, load_manifest(persist_path), embeddings.hits + embeddings.misses - before
+    return _build
+
+
+def _ids(vectordb):
+    return set(vectordb.index_to_docstore_id.values())
+
+
+def _check_consistent(vectordb, manifest):
+    ids = _ids(vectordb)
+    assert vectordb.index.ntotal == len(vectordb.index_to_docstore_id) == len(ids)
+    assert ids == {chunk_id for info in manifest["files"].values() for chunk_id in info["chunks"]}
+    assert all(vectordb.docstore.search(chunk_id) is not None for chunk_id in ids)
+
+
+def test_corpus_sin_cambios_no_embebe(build):
+    vectordb, manifest, embedded = build()
+    assert embedded == vectordb.index.ntotal > 0
+    _check_consistent(vectordb, manifest)
+
+    again, manifest_again, embedded = build()
+    assert embedded == 0
+    assert _ids(again) == _ids(vectordb)
+    assert manifest_again["files"] == manifest["files"]
+
+
+def test_pdf_modificado_reutiliza_ids_y_elimina_los_que_sobran(build, corpus):
+    vectordb, manifest, _ = build()
+    before, unchanged = manifest["files"]["report_0001.pdf"], manifest["files"]["report_0000.pdf"]
+    shutil.copy(corpus["recortado"] / "report_0001.pdf", corpus["data"] / "report_0001.pdf")
+
+    updated, manifest, embedded = build()
+    after = manifest["files"]["report_0001.pdf"]
+    assert after["sha256"] != before["sha256"] and after["pages"] == BENCH_PAGES_PER_PDF // 2
+    # Páginas iguales => mismos ids: nada se vuelve a embeber
+    assert embedded == 0
+    assert set(after["chunks"]) < set(before["chunks"])
+    removed = set(before["chunks"]) - set(after["chunks"])
+    assert not removed & _ids(updated)
+    assert manifest["files"]["report_0000.pdf"] == unchanged
+    _check_consistent(updated, manifest)
+
+    # Volver al original: solo se embeben las páginas que faltan
+    shutil.copy(corpus["original"] / "report_0001.pdf", corpus["data"] / "report_0001.pdf")
+    restored, manifest, embedded = build()
+    assert embedded == len(removed)
+    assert _ids(restored) == _ids(vectordb)
+    _check_consistent(restored, manifest)
+
+
+def test_pdf_eliminado_saca_sus_chunks(build, corpus):
+    vectordb, manifest, _ = build()
+    removed = set(manifest["files"]["report_0000.pdf"]["chunks"])
+    os.remove(corpus["data"] / "report_0000.pdf")
+
+    updated, manifest, embedded = build()
+    assert embedded == 0
+    assert "report_0000.pdf" not in manifest["files"]
+    assert _ids(updated) == _ids(vectordb) - removed
+    _check_consistent(updated, manifest)
+
+
+def test_indice_no_plano_se_reconstruye_con_los_mismos_ids(build, corpus):
+    vectordb, manifest, _ = build("HNSW16|efSearch=32")
+    assert "HNSW" in type(vectordb.index).__name__
+    _check_consistent(vectordb, manifest)
+
+    shutil.copy(corpus["recortado"] / "report_0001.pdf", corpus["data"] / "report_0001.pdf")
+    updated, manifest, _ = build("HNSW16|efSearch=32")
+    # HNSW no admite borrar: se reconstruye sin los chunks eliminados, con los vectores de la caché
+    assert "HNSW" in type(updated.index).__name__
+    assert updated.index.ntotal < vectordb.index.ntotal
+    _check_consistent(updated, manifest)
+    doc_id = manifest["files"]["report_0000.pdf"]["chunks"][0]
+    text = updated.docstore.search(doc_id).page_content
+    assert updated.similarity_search(text, k=1)[0].page_content == text
+
+
+def test_indice_cargado_sigue_con_su_generacion_tras_reconstruir(build, corpus, tmp_path):
+    # Un índice abierto en modo consulta no mezcla sus vectores con el docstore de una
+    # reconstrucción posterior, tampoco desde un hilo nuevo (el coordinador usa uno por respuesta)
+    import threading
+
+    from app.rag_pipeline import load_vectorstore_from_disk
+
+    vectordb, manifest, _ = build()
+    loaded = load_vectorstore_from_disk(str(tmp_path / "vectorstore"), embeddings=vectordb.embeddings, mmap=True)
+    doc_id = manifest["files"]["report_0000.pdf"]["chunks"][0]
+    text = loaded.docstore.search(doc_id).page_content
+
+    os.remove(corpus["data"] / "report_0000.pdf")
+    build()
+    found = []
+    thread = threading.Thread(target=lambda: found.extend(loaded.similarity_search(text, k=1)))
+    thread.start()
+    thread.join()
+    assert found[0].page_content == text
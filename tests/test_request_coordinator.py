@@ -0,0 +1,110 @@
+# tests/test_request_coordinator.py
+# Coordinador de las UIs sin OpenAI: las generaciones son streams de FakeChatModel con latencia
+# simulada y cada sesión corre en su propio hilo, como las sesiones de Streamlit.
+
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from app.fakes import FakeChatModel, fake_answer
+from app.request_coordinator import RequestCoordinator
+
+
+def _produce(llm, question, started):
+    # produce(timings) para coordinator.stream; anota cuándo llega la llamada al "LLM"
+    def generate(timings):
+        started.append((question, time.monotonic()))
+        for chunk in llm.stream(question):
+            yield chunk.content
+    return generate
+
+
+def _ask(coordinator, session_id, question, llm, started, results):
+    timings = {}
+    answer = "".join(coordinator.stream(session_id, question, _produce(llm, question, started), timings))
+    results.append((session_id, answer, timings))
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timeout esperando al coordinador"
+        time.sleep(0.01)
+
+
+def test_preguntas_identicas_comparten_una_generacion():
+    coordinator = RequestCoordinator(max_concurrency=4, session_rpm=0)
+    llm = FakeChatModel(responder=fake_answer, latency=0.4)
+    started, results = [], []
+    first = threading.Thread(target=_ask, args=(coordinator, "s0", "¿Qué es Sentinel-1?", llm, started, results))
+    first.start()
+    _wait_for(lambda: started)
+    others = [threading.Thread(target=_ask, args=(coordinator, f"s{i}", "¿Qué es Sentinel-1?", llm, started, results))
+              for i in range(1, 5)]
+    for thread in others:
+        thread.start()
+    for thread in [first] + others:
+        thread.join()
+
+    assert len(started) == 1
+    assert {answer for _, answer, _ in results} == {fake_answer("")}
+    assert sorted(timings["coalesced"] for _, _, timings in results) == [False] + [True] * 4
+    stats = coordinator.stats()
+    assert stats["upstream"] == 1 and stats["coalesced"] == 4 and stats["running"] == 0
+
+
+def test_limite_por_sesion_no_frena_a_las_demas():
+    # 120 rpm con ráfaga de 1: la sesión A obtiene un turno cada 0.5s, B no espera a A
+    coordinator = RequestCoordinator(max_concurrency=4, session_rpm=120, session_burst=1)
+    llm = FakeChatModel(responder=fake_answer)
+    started, results = [], []
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=_ask, args=(coordinator, "A", f"a{i}", llm, started, results)) for i in range(3)]
+    threads.append(threading.Thread(target=_ask, args=(coordinator, "B", "b0", llm, started, results)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    starts = {question: at - t0 for question, at in started}
+    a_starts = sorted(starts[f"a{i}"] for i in range(3))
+    assert starts["b0"] < 0.3
+    assert a_starts[0] < 0.3
+    assert all(later - earlier >= 0.4 for earlier, later in zip(a_starts, a_starts[1:]))
+    assert coordinator.stats()["rate_limited"] >= 2
+    assert all(timings["queue_s"] >= 0 for _, _, timings in results)
+
+
+def test_sesion_que_se_va_antes_del_turno_no_llama_al_llm():
+    # Con una sola generación a la vez, la pregunta de B espera en cola y B se va antes del turno
+    coordinator = RequestCoordinator(max_concurrency=1, session_rpm=0, queue_timeout_s=0.2)
+    llm = FakeChatModel(responder=fake_answer, latency=0.6)
+    started, results = [], []
+    long_question = threading.Thread(target=_ask, args=(coordinator, "A", "larga", llm, started, results))
+    long_question.start()
+    _wait_for(lambda: started)
+
+    with pytest.raises(TimeoutError):
+        list(coordinator.stream("B", "en cola", _produce(llm, "en cola", started), {}))
+    stats = coordinator.stats()
+    assert stats["queue_depth"] == 0 and stats["timed_out"] == 1
+
+    long_question.join()
+    assert [question for question, _ in started] == ["larga"]
+    assert coordinator.stats()["upstream"] == 1
+
+
+def test_buckets_de_sesiones_inactivas_se_descartan():
+    # Bucket lleno = bucket nuevo: tras recargarse no queda estado por sesión
+    coordinator = RequestCoordinator(max_concurrency=4, session_rpm=60, session_burst=1)
+    llm = FakeChatModel(responder=fake_answer)
+    started, results = [], []
+    for i in range(20):
+        _ask(coordinator, f"s{i}", f"q{i}", llm, started, results)
+    assert coordinator.stats()["sessions_tracked"] == 20
+    time.sleep(1.1)  # recarga completa de una ráfaga de 1 a 60 rpm: 1s
+    _ask(coordinator, "nueva", "q", llm, started, results)
+    assert coordinator.stats()["sessions_tracked"] == 1
@@ -0,0 +1,58 @@
+# tests/test_startup.py
+# Presupuesto de arranque del camino de consulta: tiempo de import de app.rag_pipeline (sin las
+# dependencias de ingesta ni de métricas) y tiempo hasta poder responder con el índice del repo.
+# Se mide en un proceso nuevo para que nada esté ya importado.
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+IMPORT_BUDGET_S = float(os.getenv("STARTUP_IMPORT_BUDGET_S", 1.5))
+READY_BUDGET_S = float(os.getenv("STARTUP_READY_BUDGET_S", 3.0))
+
+HEAVY_MODULES = ["mlflow", "pypdf", "langchain_openai", "langchain_text_splitters", "matplotlib", "pandas"]
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app.rag_pipeline
+print(json.dumps({"import_s": time.perf_counter() - start, "modules": sorted(sys.modules)}))
+"""
+
+READY_SCRIPT = """
+import json, time
+start = time.perf_counter()
+from app.rag_pipeline import VECTOR_DIR, build_chain, load_vectorstore_from_disk
+from app.fakes import FakeChatModel, FakeEmbeddings, fake_answer
+vectordb = load_vectorstore_from_disk(VECTOR_DIR, embeddings=FakeEmbeddings(), mmap=True)
+chain = build_chain(vectordb, llm=FakeChatModel(responder=fake_answer))
+docs = chain.retriever.invoke("What is the Sentinel-1 IW mode?")
+print(json.dumps({"ready_s": time.perf_counter() - start, "n_docs": len(docs)}))
+"""
+
+
+def _run(script):
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_rapido_sin_dependencias_pesadas():
+    pytest.importorskip("langchain_core")
+    result = _run(IMPORT_SCRIPT)
+    cargados = [m for m in HEAVY_MODULES if m in result["modules"]]
+    assert not cargados, f"app.rag_pipeline importa dependencias pesadas: {cargados}"
+    assert result["import_s"] <= IMPORT_BUDGET_S, f"Import de {result['import_s']:.2f}s (presupuesto {IMPORT_BUDGET_S}s)"
+
+
+def test_tiempo_hasta_responder():
+    pytest.importorskip("faiss")
+    if not os.path.exists(os.path.join(ROOT, "vectorstore", "format.json")):
+        pytest.skip("No hay índice en vectorstore/")
+    result = _run(READY_SCRIPT)
+    assert result["n_docs"] > 0
+    assert result["ready_s"] <= READY_BUDGET_S, f"Listo en {result['ready_s']:.2f}s (presupuesto {READY_BUDGET_S}s)"